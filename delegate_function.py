@@ -1,9 +1,28 @@
+import atexit
+import collections
 from contextlib import contextmanager
 import copy
+import concurrent.futures
+import functools
+import cProfile
+import hashlib
+import importlib
+import io
+import math
+import mmap
+import select
 import shutil
+import signal
+import socket
 import subprocess
+import tarfile
 import sys
 from typing import Any
+from concurrent.futures import Future
+import fnmatch
+import getpass
+import glob
+import shlex
 import click
 import tempfile
 import logging as log
@@ -11,6 +30,16 @@ import dill as pickle
 import os
 import uuid 
 import platform
+import pstats
+import py_compile
+import random
+import re
+import threading
+import time
+import traceback
+import tracemalloc
+import zipfile
+import zipimport
 
 import yaml
 
@@ -29,6 +58,150 @@ if is_debug_enabled():
 ##########################################################################
           """)
     
+class _Metric:
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(sorted(labels.items()))
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+    def _format_labels(self, key, extra=()):
+        labels = list(key) + list(extra)
+        if not labels:
+            return ""
+        escaped = [(k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for k, v in labels]
+        return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def _prometheus_lines(self):
+        with self._lock:
+            return [f"{self.name}{self._format_labels(k)} {v}" for k, v in sorted(self._values.items())]
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name, help, buckets):
+        super().__init__(name, help)
+        self.buckets = sorted(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            v = self._values.setdefault(key, dict(count=0, sum=0, buckets=[0] * len(self.buckets)))
+            v['count'] += 1
+            v['sum'] += value
+            for i, b in enumerate(self.buckets):
+                if value <= b:
+                    v['buckets'][i] += 1
+                    break
+
+    def get(self, **labels):
+        """
+        Return a dict with the :code:`count` and :code:`sum` of the observations and the cumulative count for each bucket in :code:`buckets`.
+        """
+        with self._lock:
+            v = self._values.get(self._key(labels), dict(count=0, sum=0, buckets=[0] * len(self.buckets)))
+            return dict(count=v['count'], sum=v['sum'], buckets=self._cumulative(v))
+
+    def _cumulative(self, v):
+        r = {}
+        total = 0
+        for b, c in zip(self.buckets, v['buckets']):
+            total += c
+            r[b] = total
+        return r
+
+    def _prometheus_lines(self):
+        lines = []
+        with self._lock:
+            for k, v in sorted(self._values.items()):
+                for b, c in self._cumulative(v).items():
+                    lines.append(f"{self.name}_bucket{self._format_labels(k, [('le', repr(float(b)))])} {c}")
+                lines.append(f"{self.name}_bucket{self._format_labels(k, [('le', '+Inf')])} {v['count']}")
+                lines.append(f"{self.name}_sum{self._format_labels(k)} {v['sum']}")
+                lines.append(f"{self.name}_count{self._format_labels(k)} {v['count']}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    A set of counters and histograms kept in this process.  Read them with :code:`get()` on each metric, or export all of them in 
+    Prometheus text format with :code:`to_prometheus()` or :code:`write_prometheus_textfile()`.
+    """
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def counter(self, name, help):
+        return self._register(name, lambda: Counter(name, help))
+
+    def histogram(self, name, help, buckets):
+        return self._register(name, lambda: Histogram(name, help, buckets))
+
+    def get_metric(self, name):
+        return self._metrics[name]
+
+    def reset(self):
+        for m in self._metrics.values():
+            m.reset()
+
+    def to_prometheus(self):
+        lines = []
+        for m in self._metrics.values():
+            lines.append(f"# HELP {m.name} {m.help}")
+            lines.append(f"# TYPE {m.name} {m.type}")
+            lines += m._prometheus_lines()
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus_textfile(self, path):
+        """
+        Write the metrics to :code:`path` for node_exporter's textfile collector.  The file is replaced atomically.
+        """
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, "w") as f:
+            f.write(self.to_prometheus())
+        os.replace(temporary, path)
+
+    def _register(self, name, make):
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = make()
+            return self._metrics[name]
+
+
+LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 600, 1800, 3600]
+SIZE_BUCKETS = [2 ** (10 + 2 * i) for i in range(12)]
+
+metrics = MetricsRegistry()
+_calls = metrics.counter("delegate_function_calls_total", "Delegated calls started.")
+_failures = metrics.counter("delegate_function_failures_total", "Delegated calls that raised an exception.")
+_call_seconds = metrics.histogram("delegate_function_call_seconds", "Latency of delegated calls.", LATENCY_BUCKETS)
+_before_image_bytes = metrics.histogram("delegate_function_before_image_bytes", "Size of before images.", SIZE_BUCKETS)
+_after_image_bytes = metrics.histogram("delegate_function_after_image_bytes", "Size of after images.", SIZE_BUCKETS)
+_subprocesses = metrics.counter("delegate_function_subprocesses_total", "Subprocesses spawned by delegates.")
+_command_seconds = metrics.histogram("delegate_function_command_seconds", "Time spent running subprocesses (e.g., ssh, scp, setfacl, salloc) by command.", LATENCY_BUCKETS)
+
+
 class BaseDelegate:
 
     """
@@ -46,7 +219,39 @@ class BaseDelegate:
     :code:`"SHELL"` will get you a shell running in the delegate context.
 
     For some delegates, you may also need to pass :code:`interactive=True` to interact with the shell.
+
+    The object's class can control which of its attributes get shipped to and from the delegate by defining 
+    :code:`delegate_function_attributes`.  It's a dict (or a method returning one) with any of these keys:
+
+    * :code:`inputs`:  The attributes sent to the delegate.  Defaults to all of them.
+    * :code:`outputs`:  The attributes sent back and merged into the caller's object.  Defaults to all of them.
+    * :code:`local`:  Attributes that are never shipped in either direction (e.g., caches and file handles).
+
+    For example :code:`delegate_function_attributes = dict(inputs=["_source"], outputs=["_score"], local=["_cache"])`.
+
+    Each call is counted in :code:`metrics`, labeled with the delegate's class and the name of the chain it belongs to.
+
+    Delegates that can limit resources (:class:`SlurmDelegate`, :class:`DockerDelegate`, and :class:`SuDockerDelegate`) take their 
+    limits from (in order of precedence) the :code:`resource_hints()` context the call was made in, the object's class, which can map 
+    method names to hints with a :code:`delegate_function_resources` attribute (e.g., 
+    :code:`delegate_function_resources = dict(train=dict(cpus=32))`), and the delegate's :code:`resources` argument.
+
+    Calls made inside a :code:`profiling()` context are profiled where the method actually runs.
     """
+
+    _chain_name = None
+
+    # How long the delegated method itself ran during the last call, as measured by the last delegate in the chain.
+    _method_seconds = None
+
+    _resources = None
+    _call_resources = None
+
+    _profile_options = None
+    _profile_data = None
+
+    _lazy_threshold = None
+
     def __init__(self, subdelegate=None, debug_pre_hook=None, interactive=False):
         self._subdelegate = subdelegate
 
@@ -68,7 +273,34 @@ class BaseDelegate:
         self._method = method
         self._argc = argc
         self._kwargs = kwargs
-        return self._do_invoke()
+        self._call_resources = getattr(_resource_context, "hints", None)
+        self._profile_options = getattr(_profile_context, "options", None)
+        self._profile_data = None
+
+        # Only the outermost delegate in this thread collects the profile.
+        collector = getattr(_profile_context, "collector", None)
+        _profile_context.collector = None
+
+        labels = self._metric_labels()
+        _calls.inc(**labels)
+        start = time.time()
+        try:
+            # Only the outermost delegate in this thread applies workspace changes.
+            with _workspace_call():
+                r = self._do_invoke()
+        except BaseException:
+            _failures.inc(**labels)
+            raise
+        finally:
+            _call_seconds.observe(time.time() - start, **labels)
+            _profile_context.collector = collector
+        if collector is not None:
+            collector._add(self._profile_data)
+        return r
+
+    def _metric_labels(self):
+        return dict(delegate=type(self).__name__,
+                    chain=self._chain_name or type(self).__name__.replace("Delegate", ""))
 
 
     def _do_invoke(self):
@@ -83,10 +315,69 @@ class BaseDelegate:
 
         if self._subdelegate:
             log.debug(f"Delegating to subdelegate: {self._subdelegate}")
-            return self._subdelegate.invoke(self._obj, self._method, *self._argc, **self._kwargs)
+            with resource_hints(**(self._call_resources or {})), _profile_options(self._profile_options):
+                r = self._subdelegate.invoke(self._obj, self._method, *self._argc, **self._kwargs)
+            self._method_seconds = self._subdelegate._method_seconds
+            self._profile_data = self._subdelegate._profile_data
+            return r
         else:
             log.debug(f"Invoking method locally")
-            return getattr(self._obj, self._method)(*self._argc, **self._kwargs)
+            start = time.time()
+            with _profiled(self._profile_options) as self._profile_data:
+                r = getattr(self._obj, self._method)(*self._argc, **self._kwargs)
+            self._method_seconds = time.time() - start
+            return r
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        obj = state.get("_obj")
+        lazy = self._lazy_threshold is not None and self._subdelegate is None and obj is not None and _can_load_lazily(type(obj))
+        if obj is not None and (lazy or _get_shipping_spec(obj) is not None):
+            state["_obj"] = _ObjectImage(obj, lazy_threshold=self._lazy_threshold if lazy else None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+
+    def _make_after_image(self, return_value):
+        """
+        Build the after image that carries the results of the delegated method back to the caller.
+        """
+        _restore_lazy_object(self._obj)
+        # Without a shipping spec, the object goes back whole, so its class's own pickling applies.
+        if _get_shipping_spec(self._obj) is None:
+            obj_image = dict(obj=self._obj)
+        else:
+            obj_image = dict(obj_state=_select_attributes(self._obj, "outputs"))
+        return dict(**obj_image,
+                    return_value=return_value,
+                    workspace_changes=_take_pending_workspace_changes(),
+                    method_seconds=self._method_seconds,
+                    profile=self._profile_data)
+
+    def _merge_after_image(self, after, obj=None):
+        """
+        Copy the changes the delegated method made to the object (:code:`self._obj` by default) back into our copy of it and return 
+        the method's return value.
+        """
+        if obj is None:
+            obj = self._obj
+        obj.__dict__.update(after['obj'].__dict__ if 'obj' in after else after['obj_state'])
+        self._method_seconds = after['method_seconds']
+        self._profile_data = after['profile']
+        for changes in after['workspace_changes']:
+            _deliver_workspace_changes(changes)
+        return after['return_value']
+
+    def _get_resources(self):
+        """
+        The resource hints for the current call, merged from the delegate, the method, and the call.
+        """
+        resources = dict(self._resources or {})
+        resources.update((getattr(self._obj, "delegate_function_resources", None) or {}).get(self._method, {}))
+        resources.update(self._call_resources or {})
+        _check_resource_hints(resources)
+        return resources
 
     def _execute_debug_pre_hook(self):
 
@@ -100,6 +391,142 @@ class BaseDelegate:
         else:
             log.debug(f"No pre_debug_hook for {self}")
 
+_SHIPPING_KEYS = ["inputs", "outputs", "local"]
+
+def _get_shipping_spec(obj):
+    spec = getattr(obj, "delegate_function_attributes", None)
+    if callable(spec):
+        spec = spec()
+    if spec is not None:
+        unknown = set(spec) - set(_SHIPPING_KEYS)
+        if unknown:
+            raise DelegateFunctionException(f"Unknown keys in delegate_function_attributes of {type(obj).__name__}: {sorted(unknown)}.  Allowed keys are {_SHIPPING_KEYS}.")
+    return spec
+
+def _select_attributes(obj, direction):
+    """
+    Return the part of :code:`obj.__dict__` that should be shipped in :code:`direction` (:code:`"inputs"` or :code:`"outputs"`).
+    """
+    spec = _get_shipping_spec(obj)
+    if spec is None:
+        return obj.__dict__
+    local = set(spec.get("local", []))
+    names = spec.get(direction)
+    return {k: v for k, v in obj.__dict__.items() if k not in local and (names is None or k in names)}
+
+def _rebuild_object(cls, state):
+    obj = cls.__new__(cls)
+    obj.__dict__.update(state)
+    return obj
+
+class _ObjectImage:
+    """
+    Stands in for an object while its delegate is pickled, so only its input attributes are shipped.  It unpickles as the object itself.
+
+    With :code:`lazy_threshold`, attributes that pickle to at least that many bytes go into a sidecar file instead, and are only
+    unpickled when the method first uses them.
+    """
+    def __init__(self, obj, lazy_threshold=None):
+        self._obj = obj
+        self._lazy_threshold = lazy_threshold
+
+    def __reduce__(self):
+        cls = type(self._obj)
+        state = _select_attributes(self._obj, "inputs")
+        if self._lazy_threshold is None or not _can_load_lazily(cls):
+            return (_rebuild_object, (cls, state))
+
+        eager = {}
+        sections = {}
+        fd, path = tempfile.mkstemp(suffix=".lazy")
+        with os.fdopen(fd, "wb") as f:
+            for name, value in state.items():
+                data = pickle.dumps(value)
+                if len(data) < self._lazy_threshold:
+                    eager[name] = value
+                else:
+                    sections[name] = (f.tell(), len(data))
+                    f.write(data)
+        if not sections:
+            os.remove(path)
+            return (_rebuild_object, (cls, state))
+        return (_rebuild_lazy_object, (cls, eager, sections, _SidecarFile(path, owned=True)))
+
+_PICKLING_METHODS = ["__getstate__", "__setstate__", "__reduce__", "__reduce_ex__", "__getnewargs__", "__getnewargs_ex__"]
+
+def _can_load_lazily(cls):
+    """
+    Lazy loading rebuilds the object from its :code:`__dict__`, so it's only safe for plain classes that don't pickle themselves.
+    """
+    return (type(cls) is type and getattr(cls, "__getattr__", None) is None and not hasattr(cls, "__slots__") and
+            all(getattr(cls, m, None) is getattr(object, m, None) for m in _PICKLING_METHODS))
+
+class _LazyAttributes:
+    """
+    The attributes of an object that haven't been unpickled yet, and where they are in their sidecar file.
+    """
+    def __init__(self, cls, sidecar, sections):
+        self.cls = cls
+        self.sections = sections
+        self._sidecar = sidecar
+        self._image_state = getattr(_image_context, "state", None)
+        self._map = None
+
+    def load(self, name):
+        offset, length = self.sections.pop(name)
+        if self._map is None:
+            with open(self._sidecar.path, "rb") as f:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        # The attribute may contain sidecar files of its own, which are named relative to the image.
+        saved = getattr(_image_context, "state", None)
+        _image_context.state = self._image_state
+        try:
+            with memoryview(self._map)[offset:offset + length] as section:
+                return pickle.loads(section)
+        finally:
+            _image_context.state = saved
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+
+_lazy_attributes = {}
+_lazy_classes = {}
+
+def _lazy_getattr(self, name):
+    lazy = _lazy_attributes.get(id(self))
+    if lazy is None or name not in lazy.sections:
+        raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}'")
+    log.debug(f"Loading {name} on first use")
+    value = lazy.load(name)
+    self.__dict__[name] = value
+    return value
+
+def _lazy_class(cls):
+    """
+    A subclass of :code:`cls` that loads lazy attributes when they're first used.
+    """
+    if cls not in _lazy_classes:
+        _lazy_classes[cls] = type(cls.__name__, (cls,), dict(__getattr__=_lazy_getattr,
+                                                             __module__=cls.__module__,
+                                                             __qualname__=cls.__qualname__))
+    return _lazy_classes[cls]
+
+def _rebuild_lazy_object(cls, state, sections, sidecar):
+    obj = _rebuild_object(cls, state)
+    obj.__class__ = _lazy_class(cls)
+    _lazy_attributes[id(obj)] = _LazyAttributes(cls, sidecar, sections)
+    return obj
+
+def _restore_lazy_object(obj):
+    """
+    Turn :code:`obj` back into an instance of its own class.  Attributes that were never used stay unloaded, so they aren't sent back either.
+    """
+    lazy = _lazy_attributes.pop(id(obj), None)
+    if lazy is not None:
+        obj.__class__ = lazy.cls
+        lazy.close()
+
 class TrivialDelegate(BaseDelegate):
     pass
 
@@ -114,6 +541,7 @@ def DelegateChain(*argc, **kwargs):
 
     :code:`**kwargs` is passed to all the factories.
     """
+    name = "".join(map(lambda x: x.__name__.replace("Delegate", ""), argc))
     def DelegateChainFactory():
         next_delegate = None
         for d_class in reversed(argc):
@@ -121,12 +549,216 @@ def DelegateChain(*argc, **kwargs):
                 kwargs["interactive"] = True
 
             next_delegate = d_class(subdelegate=next_delegate, **kwargs)
+
+        d = next_delegate
+        while d is not None:
+            d._chain_name = name
+            d = getattr(d, "_subdelegate", None)
         return next_delegate
-    name = "".join(map(lambda x: x.__name__.replace("Delegate", ""), argc))
     DelegateChainFactory.__name__ = name
     DelegateChainFactory.pytest_name = "_to_".join(map(lambda x:x.__name__, argc))
     return DelegateChainFactory
 
+@contextmanager
+def _timed_command(delegate, cmd):
+    labels = dict(delegate=delegate, command=os.path.basename(cmd[0]))
+    _subprocesses.inc(**labels)
+    start = time.time()
+    try:
+        yield
+    finally:
+        _command_seconds.observe(time.time() - start, **labels)
+
+RESOURCE_HINTS = ["cpus", "memory", "time", "exclusive"]
+
+_resource_context = threading.local()
+
+def _check_resource_hints(hints):
+    unknown = set(hints or {}) - set(RESOURCE_HINTS)
+    if unknown:
+        raise DelegateFunctionException(f"Unknown resource hints: {sorted(unknown)}.  Allowed hints are {RESOURCE_HINTS}.")
+
+@contextmanager
+def resource_hints(**hints):
+    """
+    Attach resource hints to the delegated calls made inside the context:
+
+    * :code:`cpus`:  Number of cores.
+    * :code:`memory`:  Memory limit in megabytes, or a string with a unit (e.g., :code:`"8G"`).
+    * :code:`time`:  Time limit in seconds, or a string in Slurm's format (e.g., :code:`"1:30:00"`).
+    * :code:`exclusive`:  Whether the call needs a node to itself.
+
+    Nested contexts are merged, with the inner one taking precedence.  The hints travel with the delegate chain, so they reach 
+    delegates on other hosts.
+    """
+    _check_resource_hints(hints)
+    saved = getattr(_resource_context, "hints", None)
+    _resource_context.hints = dict(saved or {}, **hints)
+    try:
+        yield
+    finally:
+        _resource_context.hints = saved
+
+def _memory_arg(memory, unit):
+    """
+    Numbers are megabytes, rounded up since Slurm and docker want whole ones.  Strings (e.g., :code:`"2G"`) pass through.
+    """
+    return str(memory) if isinstance(memory, str) else f"{math.ceil(memory)}{unit}"
+
+def _slurm_resource_args(resources):
+    args = []
+    if "cpus" in resources:
+        args.append(f"--cpus-per-task={resources['cpus']}")
+    if "memory" in resources:
+        args.append(f"--mem={_memory_arg(resources['memory'], 'M')}")
+    if "time" in resources:
+        args.append(f"--time={_slurm_time_arg(resources['time'])}")
+    if resources.get("exclusive"):
+        args.append("--exclusive")
+    return args
+
+_SLURM_TIME_FORMAT = re.compile(r"(\d+-)?\d+(:\d+){0,2}|UNLIMITED|INFINITE")
+
+def _slurm_time_arg(t):
+    """
+    Slurm wants whole minutes, or a string like :code:`"1-12:00:00"`.
+    """
+    if isinstance(t, str):
+        if not _SLURM_TIME_FORMAT.fullmatch(t):
+            raise DelegateFunctionException(f"Time limit '{t}' isn't in Slurm's format (e.g., '90', '1:30:00', or '1-12:00:00').")
+        return t
+    return math.ceil(t / 60)
+
+def _docker_backend():
+    return f"docker:{os.environ.get('DOCKER_HOST', 'local')}"
+
+def _docker_resource_args(resources):
+    args = []
+    if "cpus" in resources:
+        args += ["--cpus", str(resources['cpus'])]
+    if "memory" in resources:
+        args += ["--memory", _memory_arg(resources['memory'], 'm')]
+    return args
+
+_profile_context = threading.local()
+
+class CallProfile:
+    """
+    The profiles collected by :code:`profiling()`.
+
+    :code:`stats` is a :code:`pstats.Stats` with the cProfile results of all the calls (or :code:`None`), and :code:`snapshots` is a
+    list with a :code:`tracemalloc.Snapshot` for each call.
+    """
+    def __init__(self, options):
+        self.options = options
+        self.stats = None
+        self.snapshots = []
+
+    def _add(self, data):
+        if data is None:
+            return
+        if data.get('cprofile') is not None:
+            if self.stats is None:
+                self.stats = pstats.Stats(_StatsImage(data['cprofile']))
+            else:
+                self.stats.add(_StatsImage(data['cprofile']))
+        self.snapshots += data.get('tracemalloc') or []
+
+def _merge_profile_data(profiles):
+    """
+    Combine the profile data of several calls (e.g., the branches of a :class:`ParallelDelegate`) into one.
+    """
+    profiles = [p for p in profiles if p is not None]
+    if not profiles:
+        return None
+    stats = None
+    for p in profiles:
+        if p.get('cprofile') is None:
+            continue
+        if stats is None:
+            stats = pstats.Stats(_StatsImage(p['cprofile']))
+        else:
+            stats.add(_StatsImage(p['cprofile']))
+    return dict(cprofile=None if stats is None else stats.stats,
+                tracemalloc=[snapshot for p in profiles for snapshot in p.get('tracemalloc') or []])
+
+class _StatsImage:
+    """
+    Lets :code:`pstats.Stats` load raw cProfile stats that came back in an after image.
+    """
+    def __init__(self, stats):
+        self.stats = stats
+
+    def create_stats(self):
+        pass
+
+@contextmanager
+def profiling(cprofile=True, tracemalloc=False, tracemalloc_frames=1):
+    """
+    Profile the delegated calls made inside the context where the method runs (e.g., on the far side of an :class:`SSHDelegate`) and 
+    bring the results back.  The context yields a :class:`CallProfile` that's filled in as the calls finish::
+
+        with profiling(tracemalloc=True) as profile:
+            delegate.invoke(obj, "train")
+        profile.stats.sort_stats("cumulative").print_stats(10)
+        print(profile.snapshots[0].statistics("lineno")[:10])
+
+    Only the method is profiled, not the delegates' overhead.
+
+    Pitfalls:
+
+    1.  Calls that fail aren't included.
+    2.  :code:`SlurmDelegate.submit()` doesn't profile its jobs.
+    """
+    collector = CallProfile(dict(cprofile=cprofile, tracemalloc=tracemalloc, tracemalloc_frames=tracemalloc_frames))
+    saved = getattr(_profile_context, "collector", None), getattr(_profile_context, "options", None)
+    _profile_context.collector = collector
+    _profile_context.options = collector.options
+    try:
+        yield collector
+    finally:
+        _profile_context.collector, _profile_context.options = saved
+
+@contextmanager
+def _profile_options(options):
+    saved = getattr(_profile_context, "options", None)
+    _profile_context.options = options
+    try:
+        yield
+    finally:
+        _profile_context.options = saved
+
+@contextmanager
+def _profiled(options):
+    """
+    Run the body under the profilers :code:`options` asks for.  The context yields a dict that gets filled in with the results 
+    (or :code:`None` if there's nothing to profile).
+    """
+    if not options:
+        yield None
+        return
+    data = {}
+    profiler = cProfile.Profile() if options['cprofile'] else None
+    trace = options['tracemalloc'] and not tracemalloc.is_tracing()
+    if trace:
+        tracemalloc.start(options['tracemalloc_frames'])
+    try:
+        if profiler is not None:
+            profiler.enable()
+        try:
+            yield data
+        finally:
+            if profiler is not None:
+                profiler.disable()
+    finally:
+        if options['tracemalloc']:
+            data['tracemalloc'] = [tracemalloc.take_snapshot()]
+        if trace:
+            tracemalloc.stop()
+    if profiler is not None:
+        profiler.create_stats()
+        data['cprofile'] = profiler.stats
+
 @contextmanager
 def working_directory(path):
     here = os.getcwd()
@@ -137,19 +769,677 @@ def working_directory(path):
         os.chdir(here)
 
 
+_image_context = threading.local()
+
+@contextmanager
+def _image_sidecars(image_path):
+    """
+    Pickle or unpickle an image stored at :code:`image_path` (or :code:`None` if it isn't stored in a file).  :class:`_SidecarFile`s 
+    in the image are placed next to it, and the context yields the list of sidecar files written or referenced.
+    """
+    saved = getattr(_image_context, "state", None)
+    _image_context.state = (image_path, [])
+    try:
+        yield _image_context.state[1]
+    finally:
+        _image_context.state = saved
+
+def _remove_files(paths):
+    for p in paths:
+        try:
+            os.remove(p)
+        except FileNotFoundError:
+            pass
+
+def _remove_sidecars(image_path):
+    _remove_files(glob.glob(glob.escape(image_path) + ".sidecar*"))
+
+def _load_sidecar_file(path, relative):
+    image_path, sidecars = _image_context.state
+    if relative:
+        path = image_path + path
+    sidecars.append(path)
+    return _SidecarFile(path)
+
+class _SidecarFile:
+    """
+    A file that travels next to the image it's pickled into instead of inside of it, so it's never loaded into memory.  Images in files 
+    get the file copied (or moved, if we own it) to :code:`<image>.sidecar<n>`, and delegates that ship images copy the sidecars with them.  
+    Images that aren't stored in files (e.g., for :class:`ForkServerDelegate`) just refer to the file where it is.
+    """
+    def __init__(self, path, owned=False):
+        self.path = path
+        self._owned = owned
+
+    def adopt(self):
+        """
+        Move the file somewhere private, so it survives the cleanup of the image it came with.
+        """
+        if not self._owned:
+            fd, path = tempfile.mkstemp(suffix=".sidecar")
+            os.close(fd)
+            shutil.move(self.path, path)
+            self.path = path
+            self._owned = True
+
+    def __reduce__(self):
+        image_path, sidecars = getattr(_image_context, "state", None) or (None, [])
+        if image_path is None:
+            if self._owned:
+                sidecars.append(self.path)
+            return (_load_sidecar_file, (self.path, False))
+
+        suffix = f".sidecar{len(sidecars)}"
+        target = image_path + suffix
+        if self._owned:
+            shutil.move(self.path, target)
+            os.chmod(target, 0o644)
+        else:
+            shutil.copyfile(self.path, target)
+        sidecars.append(target)
+        return (_load_sidecar_file, (suffix, True))
+
+
+def _hash_tree(directory):
+    """
+    Map the path (relative to :code:`directory`) of every file and directory under :code:`directory` to a hash of its contents.
+    """
+    r = {}
+    for root, dirs, files in os.walk(directory):
+        for name in dirs + files:
+            path = os.path.join(root, name)
+            h = hashlib.sha256()
+            if os.path.islink(path):
+                h.update(b"link:" + os.readlink(path).encode())
+            elif os.path.isdir(path):
+                h.update(b"directory")
+            else:
+                with open(path, "rb") as f:
+                    for block in iter(lambda: f.read(1 << 20), b""):
+                        h.update(block)
+            r[os.path.relpath(path, directory).replace(os.sep, "/")] = h.hexdigest()
+    return r
+
+def _pack_directory(directory, names=None):
+    """
+    Stream :code:`names` (everything, by default) from :code:`directory` into a new compressed tar file and return its path.
+    """
+    fd, path = tempfile.mkstemp(suffix=".tar.gz")
+    with os.fdopen(fd, "wb") as f:
+        with tarfile.open(fileobj=f, mode="w|gz") as tar:
+            if names is None:
+                for name in sorted(os.listdir(directory)):
+                    tar.add(os.path.join(directory, name), arcname=name)
+            else:
+                for name in names:
+                    tar.add(os.path.join(directory, name), arcname=name, recursive=False)
+    return path
+
+def _unpack_archive(archive, directory, filter="data"):
+    """
+    Unpack :code:`archive` into :code:`directory`.  :code:`filter` is a :code:`tarfile` extraction filter.  The default,
+    :code:`"data"`, refuses links that point outside :code:`directory`, so use :code:`"tar"` for archives of the caller's own files.
+    """
+    with tarfile.open(archive, mode="r|gz") as tar:
+        if hasattr(tarfile, "data_filter"):
+            tar.extractall(directory, filter=filter)
+        else:
+            tar.extractall(directory)
+
+def _safe_join(directory, name):
+    path = os.path.normpath(os.path.join(directory, name))
+    if not path.startswith(os.path.join(directory, "")):
+        raise DelegateFunctionException(f"Workspace path {name} is outside of the workspace.")
+    return path
+
+
+_workspace_context = threading.local()
+
+class Workspace:
+    """
+    A directory in the calling process that :class:`TemporaryDirectoryDelegate` copies into its temporary directory, and that 
+    receives the files the delegated function changes.  It's packed up fresh for each call.
+    """
+    def __init__(self, directory):
+        self._directory = os.path.abspath(directory)
+        self._id = uuid.uuid4().hex
+        self._archive = None
+        self._local = True
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        if self._local:
+            self._register()
+            state['_archive'] = _SidecarFile(_pack_directory(self._directory), owned=True)
+            state['_local'] = False
+        return state
+
+    def __deepcopy__(self, memo):
+        # Copies (e.g., for the branches of a ParallelDelegate) use the same directory or archive, so there's nothing to pack.
+        r = Workspace.__new__(Workspace)
+        r.__dict__.update(self.__dict__)
+        return r
+
+    def _register(self):
+        """
+        Tell the current call that changes to this workspace should be applied here.
+        """
+        call = getattr(_workspace_context, "call", None)
+        if call is not None:
+            call.origins[self._id] = self._directory
+
+    def extract(self, directory):
+        """
+        Fill :code:`directory` with the workspace's contents and return a manifest for :code:`collect_changes()`.
+        """
+        if self._archive is None:
+            self._register()
+            shutil.copytree(self._directory, directory, symlinks=True, dirs_exist_ok=True)
+        else:
+            # The workspace is the caller's, so its symlinks (including absolute ones) are kept as they are.
+            _unpack_archive(self._archive.path, directory, filter="tar")
+        return _hash_tree(directory)
+
+    def collect_changes(self, directory, manifest):
+        """
+        Send the files and directories in :code:`directory` that were created, changed, or deleted since :code:`extract()` back 
+        toward the caller.
+        """
+        current = _hash_tree(directory)
+        changed = sorted(n for n, h in current.items() if manifest.get(n) != h)
+        deleted = sorted(n for n in manifest if n not in current)
+        log.debug(f"Workspace {self._id}: {len(changed)} changed files, {len(deleted)} deleted files")
+        archive = _SidecarFile(_pack_directory(directory, changed), owned=True) if changed else None
+        _deliver_workspace_changes(_WorkspaceChanges(self._id, archive, deleted))
+
+
+class _WorkspaceChanges:
+    def __init__(self, workspace_id, archive, deleted):
+        self.workspace_id = workspace_id
+        self.archive = archive
+        self.deleted = deleted
+
+    def apply(self, directory):
+        if self.archive is not None:
+            _unpack_archive(self.archive.path, directory)
+        # Deeper paths sort after their parents, so directories are emptied before they're removed.
+        for name in sorted(self.deleted, reverse=True):
+            path = _safe_join(directory, name)
+            if os.path.isdir(path) and not os.path.islink(path):
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                _remove_files([path])
+        self.discard()
+
+    def discard(self):
+        if self.archive is not None:
+            _remove_files([self.archive.path])
+            self.archive = None
+
+class _WorkspaceCall:
+    """
+    The workspace changes that have come back during one call, and where the workspaces that live in this process are.
+    """
+    def __init__(self):
+        self.origins = {}
+        self.changes = []
+
+    def merge(self, other):
+        self.origins.update(other.origins)
+        self.changes += other.changes
+        other.changes = []
+
+    def apply(self):
+        """
+        Apply the changes to the workspaces that live in this process, and return the rest.
+        """
+        rest = []
+        for changes in self.changes:
+            directory = self.origins.get(changes.workspace_id)
+            if directory is None:
+                rest.append(changes)
+            else:
+                changes.apply(directory)
+        self.changes = []
+        return rest
+
+    def finish(self):
+        for changes in self.apply():
+            log.warning(f"Dropping changes to workspace {changes.workspace_id}, which doesn't live in this process.")
+            changes.discard()
+
+    def discard(self):
+        for changes in self.changes:
+            changes.discard()
+        self.changes = []
+
+@contextmanager
+def _workspace_call(call=None):
+    """
+    Collect the workspace changes delivered in this thread during the context in :code:`call`, and yield it.  Without :code:`call`,
+    join the call that's collecting them already, or start a new one and apply its changes at the end.  The changes are discarded
+    if the context fails.
+    """
+    saved = getattr(_workspace_context, "call", None)
+    if call is None and saved is not None:
+        yield saved
+        return
+    current = call or _WorkspaceCall()
+    _workspace_context.call = current
+    try:
+        yield current
+    except BaseException:
+        current.discard()
+        raise
+    else:
+        if call is None:
+            current.finish()
+    finally:
+        _workspace_context.call = saved
+
+def _deliver_workspace_changes(changes):
+    """
+    Hold :code:`changes` in the current call until it's applied or they're sent on in the next after image.
+    """
+    call = getattr(_workspace_context, "call", None)
+    if call is None:
+        log.warning(f"Dropping changes to workspace {changes.workspace_id} that arrived outside of a call.")
+        changes.discard()
+        return
+    if changes.archive is not None:
+        changes.archive.adopt()
+    call.changes.append(changes)
+
+def _take_pending_workspace_changes():
+    """
+    Apply the current call's changes to the workspaces that live in this process and return the rest.
+    """
+    call = getattr(_workspace_context, "call", None)
+    return [] if call is None else call.apply()
+
+
 class TemporaryDirectoryDelegate(BaseDelegate):
+    """
+    Run the function in a new temporary directory.
+
+    With :code:`workspace`, the contents of that directory on the caller are copied into the temporary directory first, and files 
+    and directories the function creates, changes, or deletes there are updated in the caller's directory afterward.  At each hop, the files travel 
+    as compressed tar streams next to the before and after images, and only the files that changed come back.
+    """
+    def __init__(self, *argc, workspace=None, **kwargs):
+        super().__init__(*argc, **kwargs)
+        self._workspace = None if workspace is None else Workspace(workspace)
+
     def _do_invoke(self):
         with tempfile.TemporaryDirectory() as d:
+            if self._workspace is not None:
+                manifest = self._workspace.extract(d)
             with working_directory(d):
-                super()._do_invoke()
+                r = super()._do_invoke()
+            if self._workspace is not None:
+                self._workspace.collect_changes(d, manifest)
+            return r
+
+
+SHARED_MEMORY_ROOT = "/dev/shm"
+
+class _SharedMemoryPickler(pickle.Pickler):
+    """
+    Pickles large buffers (:code:`bytes`, :code:`bytearray`, :code:`io.BytesIO`, and numpy arrays) into separate files in a shared 
+    memory directory instead of into the pickle stream.
+    """
+    def __init__(self, file, directory, threshold, *argc, **kwargs):
+        super().__init__(file, *argc, **kwargs)
+        self._directory = directory
+        self._threshold = max(threshold, 1)
+        self._segments = {}
+
+    def persistent_id(self, obj):
+        if id(obj) in self._segments:
+            return self._segments[id(obj)]
+
+        numpy = sys.modules.get("numpy")
+        if type(obj) in (bytes, bytearray):
+            kind, meta, data = type(obj).__name__, None, memoryview(obj)
+        elif type(obj) is io.BytesIO:
+            kind, meta, data = "BytesIO", obj.tell(), obj.getbuffer()
+        elif numpy is not None and type(obj) is numpy.ndarray and not obj.dtype.hasobject and obj.flags.c_contiguous:
+            kind, meta, data = "ndarray", (obj.dtype, obj.shape), memoryview(obj).cast("B")
+        else:
+            return None
+
+        with data:
+            if data.nbytes < self._threshold:
+                return None
+            name = f"{len(self._segments)}.{kind}"
+            with open(os.path.join(self._directory, name), "wb") as f:
+                f.write(data)
+        pid = ("shared_memory", kind, name, meta)
+        self._segments[id(obj)] = pid
+        return pid
+
+class _SharedMemoryUnpickler(pickle.Unpickler):
+    def __init__(self, file, directory, *argc, **kwargs):
+        super().__init__(file, *argc, **kwargs)
+        self._directory = directory
+        self._segments = {}
+
+    def persistent_load(self, pid):
+        tag, kind, name, meta = pid
+        if tag != "shared_memory" or self._directory is None:
+            raise pickle.UnpicklingError(f"Unexpected persistent id {pid}")
+        if name not in self._segments:
+            self._segments[name] = self._load_segment(kind, name, meta)
+        return self._segments[name]
+
+    def _load_segment(self, kind, name, meta):
+        with open(os.path.join(self._directory, name), "rb") as f:
+            if kind == "ndarray":
+                # Map the segment copy-on-write so the array is backed by the shared memory directly.  The mapping 
+                # outlives the file, and it's released when the array is garbage collected.
+                import numpy
+                dtype, shape = meta
+                segment = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+                return numpy.frombuffer(segment, dtype=dtype).reshape(shape)
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as segment:
+                if kind == "bytes":
+                    return segment[:]
+                elif kind == "bytearray":
+                    return bytearray(segment)
+                elif kind == "BytesIO":
+                    r = io.BytesIO(segment[:])
+                    r.seek(meta)
+                    return r
+        raise pickle.UnpicklingError(f"Unknown shared memory segment kind '{kind}'")
+
+def _dump_after_image(after, stream, shared_memory_directory=None, shared_memory_threshold=None):
+    if shared_memory_directory is None:
+        pickle.dump(after, stream)
+    else:
+        _SharedMemoryPickler(stream, shared_memory_directory, shared_memory_threshold).dump(after)
+
+def _load_after_image(stream, shared_memory_directory=None):
+    return _SharedMemoryUnpickler(stream, shared_memory_directory).load()
+
+
+RUNNER_PACKAGES = ["delegate_function", "dill", "yaml", "click"]
+RUNNER_CACHE_DIRECTORY = "~/.cache/delegate_function/runners"
+
+_RUNNER_MAIN = """import sys
+from delegate_function import delegate_function_run
+sys.exit(delegate_function_run())
+"""
+
+_runner_zipapp = None
+_runner_zipapp_lock = threading.Lock()
+_deployed_runners = set() # (user, host, path) for runners we know SSHDelegate hosts have.
+
+def _runner_sources():
+    """
+    Return a sorted list of :code:`(archive name, path)` for the source files of :code:`RUNNER_PACKAGES`.
+    """
+    sources = []
+    for name in RUNNER_PACKAGES:
+        module = importlib.import_module(name)
+        if not hasattr(module, "__path__"):
+            sources.append((os.path.basename(module.__file__), module.__file__))
+            continue
+        root = os.path.dirname(module.__file__)
+        for directory, subdirectories, files in os.walk(root):
+            subdirectories[:] = sorted(d for d in subdirectories if d not in ["__pycache__", "tests"])
+            for f in sorted(files):
+                if f.endswith(".py"):
+                    path = os.path.join(directory, f)
+                    sources.append((os.path.join(name, os.path.relpath(path, root)), path))
+    return sorted(sources)
+
+def _build_runner_zipapp():
+    """
+    Build a zipapp of :code:`delegate-function-run` and the pure-Python parts of its dependencies, with bytecode for this version of 
+    Python.  Returns the archive and a hash of its sources and the Python version.
+    """
+    sources = _runner_sources()
+    digest = hashlib.sha256(f"{sys.version_info[:2]}".encode())
+    archive = io.BytesIO()
+    archive.write(b"#!/usr/bin/env python3\n")
+    with zipfile.ZipFile(archive, "w", zipfile.ZIP_DEFLATED) as z, tempfile.TemporaryDirectory() as scratch:
+        def add(arcname, data):
+            z.writestr(zipfile.ZipInfo(arcname, date_time=(1980, 1, 1, 0, 0, 0)), data)
+        add("__main__.py", _RUNNER_MAIN)
+        for arcname, path in sources:
+            with open(path, "rb") as f:
+                source = f.read()
+            digest.update(arcname.encode() + b"\0" + hashlib.sha256(source).digest())
+            add(arcname, source)
+            # zipimport only finds bytecode next to the source, and falls back to the source if the bytecode is for another version.
+            pyc = os.path.join(scratch, "compiled.pyc")
+            py_compile.compile(path, cfile=pyc, dfile=arcname, doraise=True, 
+                               invalidation_mode=py_compile.PycInvalidationMode.UNCHECKED_HASH)
+            with open(pyc, "rb") as f:
+                add(arcname + "c", f.read())
+    return archive.getvalue(), digest.hexdigest()[:16]
+
+def _read_runner_zipapp(path):
+    """
+    Read the runner zipapp we're running from (e.g., in a hop that deployed it), since we can't rebuild it from its sources.  Returns
+    the same thing as :code:`_build_runner_zipapp()`.
+    """
+    with open(path, "rb") as f:
+        archive = f.read()
+    m = re.fullmatch(r"delegate-function-run-([0-9a-f]{16})\.pyz", os.path.basename(path))
+    return archive, m.group(1) if m else hashlib.sha256(archive).hexdigest()[:16]
+
+def _get_runner_zipapp():
+    global _runner_zipapp
+    with _runner_zipapp_lock:
+        if _runner_zipapp is None:
+            if isinstance(__loader__, zipimport.zipimporter):
+                _runner_zipapp = _read_runner_zipapp(__loader__.archive)
+            else:
+                _runner_zipapp = _build_runner_zipapp()
+        return _runner_zipapp
+
+def _runner_file_name():
+    return f"delegate-function-run-{_get_runner_zipapp()[1]}.pyz"
+
+def build_runner_zipapp(path):
+    """
+    Write the self-contained :code:`delegate-function-run` zipapp that delegates with :code:`deploy_runner=True` use to :code:`path` 
+    (e.g., to bake it into a docker image).
+    """
+    with open(path, "wb") as f:
+        f.write(_get_runner_zipapp()[0])
+    os.chmod(path, 0o755)
+
+def _install_runner(directory):
+    """
+    Make sure the runner zipapp is in :code:`directory` and return its path.
+    """
+    directory = os.path.expanduser(directory)
+    path = os.path.join(directory, _runner_file_name())
+    if not os.path.exists(path):
+        os.makedirs(directory, exist_ok=True)
+        temporary = f"{path}.{os.getpid()}.tmp"
+        build_runner_zipapp(temporary)
+        os.replace(temporary, path)
+    return path
+
+
+OUTPUT_TAIL_BYTES = 64 * 1024
+OUTPUT_MAX_LINE = 64 * 1024
+OUTPUT_DRAIN_SECONDS = 5
+
+class _OutputTail:
+    """
+    The last lines of a stream, up to about :code:`limit` characters.
+    """
+    def __init__(self, limit):
+        self._limit = limit
+        self._lines = collections.deque()
+        self._size = 0
+
+    def append(self, line):
+        self._lines.append(line)
+        self._size += len(line)
+        while self._size > self._limit and len(self._lines) > 1:
+            self._size -= len(self._lines.popleft())
+
+    def get(self):
+        return "".join(self._lines)
+
+def _pump_output(stream, name, tail, forward):
+    """
+    Copy :code:`stream` line by line into :code:`tail` and to :code:`forward(name, line, label)` until it closes.  :code:`label` is the 
+    one a delegate further down the chain relayed the line with (see :code:`_relay_output()`), or :code:`None`.  Lines keep their 
+    newline, if they have one, and lines longer than :code:`OUTPUT_MAX_LINE` bytes are split between characters.
+    """
+    def emit(data):
+        label = None
+        if data.startswith(_RELAY_MARK):
+            header = data.find(_RELAY_MARK, 1)
+            if header != -1:
+                label = data[1:header].decode(errors="replace")
+                data = data[header + 1:]
+                if data.endswith(_RELAY_UNTERMINATED + b"\n"):
+                    data = data[:-2]
+        line = data.decode(errors="replace")
+        tail.append(line)
+        try:
+            forward(name, line, label)
+        except Exception:
+            # Keep draining the pipe, or the child will block.
+            log.exception("Output handler failed")
+
+    try:
+        partial = b""
+        while True:
+            chunk = stream.read1(65536)
+            if not chunk:
+                break
+            *lines, partial = (partial + chunk).split(b"\n")
+            for line in lines:
+                emit(line + b"\n")
+            while len(partial) >= _line_limit(partial):
+                cut = _character_boundary(partial, _line_limit(partial))
+                emit(partial[:cut])
+                partial = partial[cut:]
+        if partial:
+            emit(partial)
+    finally:
+        stream.close()
+
+def _line_limit(data):
+    # Relayed lines can be a little longer, since the header doesn't count.
+    if data.startswith(_RELAY_MARK):
+        header = data.find(_RELAY_MARK, 1)
+        if header != -1:
+            return OUTPUT_MAX_LINE + header + 1 + len(_RELAY_UNTERMINATED) + 1
+    return OUTPUT_MAX_LINE
+
+def _character_boundary(data, n):
+    """
+    Move :code:`n` back to the start of the UTF-8 character it's in, unless that's more than a character's length away.
+    """
+    for i in range(n, max(n - 4, 0), -1):
+        if i >= len(data) or data[i] & 0xC0 != 0x80:
+            return i
+    return n
+
+def _echo_output(label, stream, line):
+    f = sys.stdout if stream == "stdout" else sys.stderr
+    f.write(line)
+    f.flush()
+
+def _log_output(label, stream, line):
+    log.log(log.INFO if stream == "stdout" else log.WARNING, f"[{label}] {line.rstrip(chr(10))}")
+
+_OUTPUT_HANDLERS = dict(echo=_echo_output, log=_log_output)
+
+_RELAY_MARK = b"\x1e"
+_RELAY_UNTERMINATED = b"\x1f"
+
+# Whether this process is a delegate-function-run whose output the caller is reading with _pump_output().
+_relaying_output = False
+
+def _relay_output(label, stream, line):
+    """
+    Pass a line of output on to the caller, tagged with :code:`label`, so it can tell which delegate it came from.
+    """
+    f = sys.stdout if stream == "stdout" else sys.stderr
+    f.flush()
+    f.buffer.write(_relay_record(label, line))
+    f.buffer.flush()
+
+def _relay_record(label, line):
+    record = _RELAY_MARK + label.encode() + _RELAY_MARK + line.encode(errors="replace")
+    if not line.endswith("\n"):
+        record += _RELAY_UNTERMINATED + b"\n"
+    return record
 
 
 class SubprocessDelegate(BaseDelegate):
 
-    def __init__(self, *argc, temporary_file_root=None, delegate_executable_path=None, **kwargs): 
+    """
+    Delegate a function to a new process running :code:`delegate-function-run`.
+
+    If :code:`shared_memory_threshold` is set, buffers in the after image (:code:`bytes`, :code:`bytearray`, :code:`io.BytesIO`, and 
+    numpy arrays) that are at least that many bytes come back through files in :code:`SHARED_MEMORY_ROOT` rather than through the 
+    pickled after image.  They are removed when the call finishes.  This only works for delegates that run on the same host as their 
+    caller (:class:`SubprocessDelegate` and :class:`SudoDelegate`).
+
+    With :code:`deploy_runner=True`, the delegate doesn't need :code:`delegate-function-run` (or dill, yaml, and click) installed where it 
+    runs.  Instead, it runs a zipapp of this version of the runner and its dependencies, which only needs :code:`python3`.  The zipapp is 
+    named after a hash of its contents and written once into :code:`temporary_file_root`, if it's set, so containers and cluster nodes 
+    that share it can see it, or :code:`RUNNER_CACHE_DIRECTORY` otherwise.  :class:`SSHDelegate` uploads it once per host.  Delegates
+    further down the chain pass on the zipapp they're running from.
+
+    The output of the processes the delegate starts is read as it arrives and passed, a line at a time, to 
+    :code:`output_handler(label, stream, line)`, where :code:`label` names the delegate that started the process (and host, for 
+    :class:`SSHDelegate`), :code:`stream` is :code:`"stdout"` or :code:`"stderr"`, and :code:`line` ends with its newline, if it had 
+    one.  :code:`output_handler` can also be :code:`"echo"` (the default), which copies it to our :code:`stdout` and :code:`stderr`, 
+    :code:`"log"`, which logs it with the label, or the dotted name of a function.  Delegates further down the chain relay their 
+    processes' output back with their own labels, so only the first delegate's :code:`output_handler` is used.  Only the last 
+    :code:`output_tail_bytes` of each stream are kept.  If the process fails, they end up in the :code:`stdout_tail` and 
+    :code:`stderr_tail` of the :class:`DelegateFunctionException`, and the :code:`stderr` tail is in its message.  Interactive 
+    delegates leave the output alone.
+
+    If :code:`lazy_threshold` is set and this is the last delegate in the chain, the object's attributes that pickle to at least that 
+    many bytes travel in a separate section of the image, which the delegate process memory-maps.  Each one is unpickled the first 
+    time the method uses it, and attributes the method never uses are neither loaded nor sent back.
+
+    Pitfalls:
+
+    1.  With :code:`lazy_threshold`, objects shared between lazy attributes (or between them and the rest of the object) are 
+        copied, and code that reads :code:`obj.__dict__` directly or checks :code:`type(obj) is ...` sees the difference.  Classes 
+        with :code:`__getattr__` or :code:`__slots__`, or that customize their pickling (e.g., with :code:`__getstate__` or 
+        :code:`__reduce__`), are always loaded eagerly.
+    2.  The method's arguments are always loaded before it's called.
+    """
+
+    # Whether the delegate process can see the caller's :code:`SHARED_MEMORY_ROOT`.
+    _same_host = True
+
+    # Where :code:`deploy_runner` installs the runner if there's no :code:`temporary_file_root`.  :code:`None` means the delegate's 
+    # own temporary directory.
+    _default_runner_directory = RUNNER_CACHE_DIRECTORY
+
+    def __init__(self, *argc, temporary_file_root=None, delegate_executable_path=None, shared_memory_threshold=None, deploy_runner=False, 
+                 lazy_threshold=None, output_handler="echo", output_tail_bytes=OUTPUT_TAIL_BYTES, **kwargs): 
         super().__init__(*argc, **kwargs)
+        self._lazy_threshold = lazy_threshold
+        self._output_handler = output_handler
+        self._output_tail_bytes = output_tail_bytes
         self._temporary_file_root = temporary_file_root
         self._delegate_executable_path = delegate_executable_path 
+        if deploy_runner and delegate_executable_path is not None:
+            raise DelegateFunctionException(f"{type(self).__name__} can't use both 'deploy_runner' and 'delegate_executable_path'.")
+        self._deploy_runner = deploy_runner
+        self._runner_directory = temporary_file_root or self._default_runner_directory
+        if shared_memory_threshold is not None and not self._same_host:
+            raise DelegateFunctionException(f"{type(self).__name__} doesn't support 'shared_memory_threshold', because the delegate doesn't run on the same host.")
+        self._shared_memory_threshold = shared_memory_threshold
+        self._shared_memory_directory = None
+        self._delegate_before_sidecars = []
     
     def _do_invoke(self):
 
@@ -158,26 +1448,60 @@ class SubprocessDelegate(BaseDelegate):
             #temporary_file_root = tempfile.TemporaryDirectory().name
             self._temporary_file_root = tempfile.mkdtemp()#tempfile.TemporaryDirectory() # keep the direcotry alive by holding a reference to it.
 
-        with tempfile.NamedTemporaryFile(dir=self._temporary_file_root, suffix=".before.pickle") as delegate_before:
-            os.chmod(delegate_before.name, 0o666)
-            self._delegate_before_image_name = delegate_before.name
-            pickle.dump(self, delegate_before)
-            delegate_before.flush()
-            with tempfile.NamedTemporaryFile(dir=self._temporary_file_root, suffix=".after.pickle") as delegate_after:
-                delegate_after.close()
-                self._delegate_after_image_name = delegate_after.name
-                self._run_function_in_external_process()
-                with open(delegate_after.name, "rb") as da:
-                    after = pickle.load(da)
-                self._obj.__dict__.update(after['delegate']._obj.__dict__)
-                return after['return_value']
-
-
-    def _compute_command_line(self):    
+        if self._shared_memory_threshold is not None:
+            self._shared_memory_directory = tempfile.mkdtemp(dir=SHARED_MEMORY_ROOT)
+        try:
+            with tempfile.NamedTemporaryFile(dir=self._temporary_file_root, suffix=".before.pickle") as delegate_before:
+                os.chmod(delegate_before.name, 0o666)
+                self._delegate_before_image_name = delegate_before.name
+                try:
+                    with _image_sidecars(delegate_before.name) as sidecars:
+                        pickle.dump(self, delegate_before)
+                    delegate_before.flush()
+                    self._delegate_before_sidecars = sidecars
+                    _before_image_bytes.observe(os.path.getsize(delegate_before.name), **self._metric_labels())
+                    with tempfile.NamedTemporaryFile(dir=self._temporary_file_root, suffix=".after.pickle") as delegate_after:
+                        delegate_after.close()
+                        self._delegate_after_image_name = delegate_after.name
+                        try:
+                            with scheduler.admit(self._admission_backend()):
+                                self._run_function_in_external_process()
+                            _after_image_bytes.observe(os.path.getsize(delegate_after.name), **self._metric_labels())
+                            with open(delegate_after.name, "rb") as da:
+                                with _image_sidecars(delegate_after.name):
+                                    after = _load_after_image(da, self._shared_memory_directory)
+                            return self._merge_after_image(after)
+                        finally:
+                            _remove_sidecars(delegate_after.name)
+                finally:
+                    _remove_sidecars(delegate_before.name)
+        finally:
+            if self._shared_memory_directory is not None:
+                shutil.rmtree(self._shared_memory_directory, ignore_errors=True)
+                self._shared_memory_directory = None
+
+
+    def _compute_command_line(self, relay_output=True):    
         return [self._find_delegate_function_executable(),
                 "--delegate-before", self._delegate_before_image_name,
                 "--delegate-after", self._delegate_after_image_name,
-                "--log-level", str(log.root.level)]
+                "--log-level", str(log.root.level)] + self._compute_shared_memory_args() + (self._compute_relay_args() if relay_output else [])
+
+    def _admission_backend(self):
+        """
+        The name of the backend :code:`scheduler` limits this delegate's calls on, or :code:`None` if it doesn't.
+        """
+        return "subprocess"
+
+    def _compute_relay_args(self):
+        # Interactive delegates don't read the output, so there's nobody to relay it to.
+        return [] if self._interactive else ["--relay-output"]
+
+    def _compute_shared_memory_args(self):
+        if self._shared_memory_directory is None:
+            return []
+        return ["--shared-memory-directory", self._shared_memory_directory,
+                "--shared-memory-threshold", str(self._shared_memory_threshold)]
 
 
     def _run_function_in_external_process(self):
@@ -195,16 +1519,75 @@ class SubprocessDelegate(BaseDelegate):
 
         try:
             log.debug(f"{type(self).__name__} Executing {' '.join(cmd)=}")
-            r = subprocess.run(cmd, check=True)#, capture_output=True)
-#            log.debug(f"{r.stdout.decode()}")
-#            log.debug(f"{r.stderr.decode()}")
+            with _timed_command(type(self).__name__, cmd):
+                if self._interactive:
+                    subprocess.run(cmd, check=True)
+                else:
+                    self._run_streamed(cmd)
+        except subprocess.CalledProcessError as e:
+            raise self._subprocess_failure(e) from e
+
+    def _run_streamed(self, cmd):
+        handler = _relay_output if _relaying_output else self._output_handler
+        if isinstance(handler, str):
+            handler = _OUTPUT_HANDLERS.get(handler) or _resolve_function(handler)
+        label = self._output_label()
+        forward = lambda stream, line, relayed_label: handler(relayed_label or label, stream, line)
+        tails = dict(stdout=_OutputTail(self._output_tail_bytes), stderr=_OutputTail(self._output_tail_bytes))
+        p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        # The pumps close the pipes when they're done with them.
+        pumps = [threading.Thread(target=_pump_output, args=(getattr(p, name), name, tail, forward), daemon=True)
+                 for name, tail in tails.items()]
+        for t in pumps:
+            t.start()
+        try:
+            p.wait()
+        except BaseException:
+            p.kill()
+            p.wait()
+            raise
+        # Something else (e.g., an ssh ControlMaster) can hold the pipes open after the process exits.
+        deadline = time.time() + OUTPUT_DRAIN_SECONDS
+        for t in pumps:
+            t.join(max(deadline - time.time(), 0))
+        if any(t.is_alive() for t in pumps):
+            log.warning(f"{label}: The output of {cmd[0]} is still open after it exited, so we've stopped waiting for it.")
+        if p.returncode != 0:
+            raise subprocess.CalledProcessError(p.returncode, cmd, output=tails["stdout"].get(), stderr=tails["stderr"].get())
+
+    def _output_label(self):
+        return type(self).__name__
+
+    def _subprocess_failure(self, e):
+        message = f"Delegate subprocess execution failed ({type(self).__name__}): {e}"
+        if e.stderr:
+            message += f"\n{e.stderr}"
+        r = DelegateFunctionException(message)
+        r.stdout_tail = e.stdout
+        r.stderr_tail = e.stderr
+        return r
+
+    def __getstate__(self):
+        state = super().__getstate__()
+        # Where the delegate runs, it relays its output instead, and the handler may not exist there.
+        if not isinstance(state["_output_handler"], str):
+            state["_output_handler"] = "echo"
+        return state
+
+    def _invoke_shell_output(self, cmd):
+        try:
+            log.debug(f"{type(self).__name__} Executing {' '.join(cmd)=}")
+            with _timed_command(type(self).__name__, cmd):
+                return subprocess.run(cmd, check=True, capture_output=True, text=True).stdout
         except subprocess.CalledProcessError as e:
-            raise DelegateFunctionException(f"Delegate subprocess execution failed ({type(self).__name__}): {e} {e.stdout and e.stdout.decode()} {e.stderr and e.stderr.decode()}")
+            raise self._subprocess_failure(e) from e
 
     def _execute_debug_pre_hook(self):
         super()._execute_debug_pre_hook()
 
     def _find_delegate_function_executable(self):
+        if self._deploy_runner:
+            return _install_runner(self._runner_directory or self._temporary_file_root)
         if self._delegate_executable_path is not None:
             return self._delegate_executable_path
         exe = shutil.which("delegate-function-run")
@@ -212,6 +1595,128 @@ class SubprocessDelegate(BaseDelegate):
             raise DelegateFunctionException(f"Delegate {self} on {platform.node()} can't find `delegate-function-run` executable in $PATH.")
         return exe
 
+class _ForkServer:
+    """
+    A zygote process that has already imported a set of modules.  It forks a child for each connection to its socket.
+    """
+    def __init__(self, preload_modules):
+        self._directory = tempfile.mkdtemp()
+        self.socket_path = os.path.join(self._directory, "fork-server.sock")
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            listener.bind(self.socket_path)
+            listener.listen(128)
+            code = "import delegate_function; delegate_function.delegate_function_fork_server()"
+            if isinstance(__loader__, zipimport.zipimporter):
+                # We're running from a deployed runner zipapp, which isn't on the new interpreter's path.
+                code = f"import sys; sys.path.insert(0, {__loader__.archive!r}); {code}"
+            command = [sys.executable, "-c", code,
+                       "--fd", str(listener.fileno()),
+                       "--log-level", str(log.root.level)]
+            for m in preload_modules:
+                command += ["--preload", m]
+            log.debug(f"Starting fork server: {' '.join(command)}")
+            # The fork server exits when its stdin closes, so it won't outlive us.
+            self.process = subprocess.Popen(command, pass_fds=[listener.fileno()], stdin=subprocess.PIPE)
+            _subprocesses.inc(delegate="ForkServerDelegate", command="fork-server")
+        finally:
+            listener.close()
+
+    def is_alive(self):
+        return self.process.poll() is None
+
+    def shutdown(self):
+        if self.is_alive():
+            self.process.stdin.close()
+            self.process.terminate()
+            self.process.wait()
+        shutil.rmtree(self._directory, ignore_errors=True)
+
+
+_fork_servers = {}
+_fork_servers_lock = threading.Lock()
+
+def _get_fork_server(preload_modules):
+    key = tuple(preload_modules)
+    with _fork_servers_lock:
+        server = _fork_servers.get(key)
+        if server is None or not server.is_alive():
+            if server is not None:
+                server.shutdown()
+            server = _ForkServer(preload_modules)
+            _fork_servers[key] = server
+        return server
+
+@atexit.register
+def _shutdown_fork_servers():
+    with _fork_servers_lock:
+        for server in _fork_servers.values():
+            server.shutdown()
+        _fork_servers.clear()
+
+def _recv_all(conn):
+    chunks = []
+    while True:
+        chunk = conn.recv(1 << 20)
+        if not chunk:
+            return b"".join(chunks)
+        chunks.append(chunk)
+
+
+class ForkServerDelegate(BaseDelegate):
+
+    """
+    Delegate a function to a child of a local fork server.
+
+    The fork server is started on first use and imports :code:`preload_modules` once.  Each call forks a fresh child from it, so you
+    keep the isolation of :class:`SubprocessDelegate` without paying for interpreter startup and imports on every call.  There is
+    one fork server per distinct list of :code:`preload_modules` in each process.
+
+    Pitfalls:
+
+    1.  The child is forked from the fork server, not from the caller.  It gets the caller's working directory and environment at call
+        time, but nothing else (e.g., modules imported after the fork server started).
+    2.  It doesn't support :code:`interactive`, since the child has no terminal.
+    """
+    def __init__(self, *argc, preload_modules=None, **kwargs):
+        super().__init__(*argc, **kwargs)
+        if preload_modules is None:
+            preload_modules = []
+        self._preload_modules = preload_modules
+
+    def _do_invoke(self):
+        self._execute_debug_pre_hook()
+        before_sidecars = []
+        after_sidecars = []
+        try:
+            with _image_sidecars(None) as before_sidecars:
+                request = pickle.dumps(dict(delegate=self, 
+                                            cwd=os.getcwd(), 
+                                            environ=dict(os.environ),
+                                            log_level=log.root.level))
+            _before_image_bytes.observe(len(request), **self._metric_labels())
+            server = _get_fork_server(self._preload_modules)
+            try:
+                with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as conn:
+                    conn.connect(server.socket_path)
+                    conn.sendall(request)
+                    conn.shutdown(socket.SHUT_WR)
+                    reply = _recv_all(conn)
+            except OSError as e:
+                raise DelegateFunctionException(f"Lost the connection to the fork server ({type(self).__name__}): {e}") from e
+            _after_image_bytes.observe(len(reply), **self._metric_labels())
+
+            if not reply:
+                raise DelegateFunctionException(f"Fork server child exited without returning a result ({type(self).__name__}).")
+            with _image_sidecars(None) as after_sidecars:
+                after = pickle.loads(reply)
+            if 'error' in after:
+                raise DelegateFunctionException(f"Delegated function failed in fork server child ({type(self).__name__}): {after['error']}")
+            return self._merge_after_image(after)
+        finally:
+            _remove_files(before_sidecars + after_sidecars)
+
+
 class YAMLDelegate(BaseDelegate):
     def __init__(self, configuration_file, *argc, **kwargs):
         if 'debug_pre_hook' in kwargs:
@@ -223,10 +1728,18 @@ class YAMLDelegate(BaseDelegate):
         return getattr(self._target, __name)
     
     def __setattr__(self, __name: str, __value: Any) -> None:
-        if __name in ["_debug_pre_hook", "_interactive", "_subdelegate", "_target", "_configuration_file"]:
+        if __name in ["_debug_pre_hook", "_interactive", "_subdelegate", "_target", "_configuration_file", "_chain_name"]:
             super().__setattr__(__name, __value)
         else:
             setattr(self._target, __name, __value)
+
+    @property
+    def _method_seconds(self):
+        return getattr(self.__dict__.get("_target"), "_method_seconds", None)
+
+    @property
+    def _profile_data(self):
+        return getattr(self.__dict__.get("_target"), "_profile_data", None)
     
 
     def invoke(self, obj, method, *argc, **kwargs):
@@ -250,11 +1763,14 @@ class LateBoundYAMLDelegate(YAMLDelegate):
     
 class SuDockerDelegate(SubprocessDelegate):
 
+    _same_host = False
+
     def __init__(self, docker_image, *argc, 
                  docker_user=None,
                  temporary_file_root=None, 
                  sudo_args=None,
                  docker_cmd_line_args = None,
+                 resources=None,
                  **kwargs):
         
         if temporary_file_root is None:
@@ -269,6 +1785,8 @@ class SuDockerDelegate(SubprocessDelegate):
             docker_cmd_line_args = []
 
         self._docker_cmd_line_args = docker_cmd_line_args
+        _check_resource_hints(resources)
+        self._resources = resources
         
         if sudo_args is None:
             sudo_args = []
@@ -286,6 +1804,9 @@ class SuDockerDelegate(SubprocessDelegate):
     def _compute_sudo_command_line(self):
         return ["sudo"] + self._sudo_args + self._sudo_user_args
 
+    def _admission_backend(self):
+        return _docker_backend()
+
     def _run_function_in_external_process(self):
         log.debug(f"{self._temporary_file_root=}")
         #self._invoke_shell(['setfacl', '-R', '-m', f'u:{self._user}:rwX', self._temporary_file_root])
@@ -299,6 +1820,7 @@ class SuDockerDelegate(SubprocessDelegate):
         return ['docker', 'run',
                 '--workdir', '/tmp',
                 *(["-it"] if self._interactive else []),
+                *_docker_resource_args(self._get_resources()),
                 *self.get_docker_cmd_line_args(),
                 self._docker_image]
 
@@ -312,8 +1834,13 @@ class SudoDelegate(SubprocessDelegate):
 
     1.  :code:`sudo` removes much of the environment by default.
     2.  The delegate use access control lists to make the files it uses  (and the directories leading to them) readable, writable, and searchable by the target user.
+    3.  With :code:`deploy_runner=True` and no :code:`temporary_file_root`, the runner goes in the delegate's temporary directory 
+        instead of :code:`RUNNER_CACHE_DIRECTORY`, because the target user usually can't read our home directory.
     
     """
+
+    _default_runner_directory = None
+
     def __init__(self, *args, user=None, sudo_args=None, **kwargs):
         super().__init__(*args, **kwargs)
         
@@ -330,63 +1857,652 @@ class SudoDelegate(SubprocessDelegate):
     def _compute_command_line(self):
         return ["sudo"] + self._sudo_args + self._sudo_user_args + super()._compute_command_line()
 
+    def _admission_backend(self):
+        return "sudo"
+
     def _run_function_in_external_process(self):
+        # Compute the command line first, since it may install the runner in self._temporary_file_root.
+        command = self._compute_command_line()
         # This is not right:  self._temporary_file_root is constant and shared among users, so make it writable by the user seems unwise
         self._invoke_shell(['setfacl', '-R', '-m', f'u:{self._user}:rwX', self._temporary_file_root])
-        command = self._compute_command_line()
+        if self._shared_memory_directory is not None:
+            self._invoke_shell(['setfacl', '-m', f'u:{self._user}:rwx', self._shared_memory_directory])
         self._invoke_shell(command)
 
 
+class _HostStats:
+    def __init__(self):
+        self.outstanding = 0
+        self.latency = None
+        self.failures = 0
+        self.unavailable_until = 0
+
+
+_host_stats = {}
+_host_stats_lock = threading.Lock()
+
+
+_scheduling_context = threading.local()
+
+@contextmanager
+def scheduling(user=None, priority=0):
+    """
+    Set the user and priority that :code:`scheduler` uses for the delegated calls made inside the context.  The user defaults to the 
+    login name.
+    """
+    saved = getattr(_scheduling_context, "settings", None)
+    _scheduling_context.settings = dict(user=user, priority=priority)
+    try:
+        yield
+    finally:
+        _scheduling_context.settings = saved
+
+
+class _Waiter:
+    def __init__(self, user, priority, sequence):
+        self.user = user
+        self.priority = priority
+        self.sequence = sequence
+
+
+class _Backend:
+    def __init__(self):
+        self.running = collections.Counter()
+        self.waiting = []
+
+    def total_running(self):
+        return sum(self.running.values())
+
+
+_admission_wait_seconds = metrics.histogram("delegate_function_admission_wait_seconds", "Time calls waited for admission to a backend.", LATENCY_BUCKETS)
+_admission_rejections = metrics.counter("delegate_function_admission_rejections_total", "Calls rejected because a backend's queue was full or they waited too long.")
+
+
+class AdmissionScheduler:
+    """
+    Limits how many delegated calls can use each backend at once, so a burst of calls doesn't start hundreds of :code:`ssh`, 
+    :code:`salloc`, or :code:`docker` processes.
+
+    Backends are named :code:`ssh:<host>`, :code:`slurm:<partition>` (:code:`slurm:default` without one), :code:`docker:<daemon>` 
+    (:code:`$DOCKER_HOST`, or :code:`docker:local`), :code:`sudo`, and :code:`subprocess`.  :code:`limits` maps shell-style patterns to the 
+    number of calls allowed to run at once on each matching backend (e.g., :code:`{"ssh:*": 8}` allows 8 calls per host).  An exact 
+    backend name beats a pattern, and backends without a limit are unlimited.
+
+    Calls over the limit wait in a queue.  The next call admitted is the one with the highest priority, and among those, the one whose 
+    user has the fewest calls running on the backend, and then the oldest.  If :code:`max_queue` calls are already waiting, or a call 
+    waits more than :code:`queue_timeout` seconds, it fails with a :class:`DelegateFunctionException`.
+
+    There's one scheduler per process, :code:`scheduler`.  Configure it with :code:`configure()`, or with an :code:`admission` section in a
+    :class:`DelegateGenerator` spec::
+
+        admission:
+          limits:
+            "ssh:*": 8
+            "slurm:*": 20
+          max_queue: 500
+          queue_timeout: 600
+
+    Use :code:`scheduling()` to set the user and priority of calls.
+    """
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._backends = {}
+        self._sequence = 0
+        self.reset()
+
+    def configure(self, limits=None, max_queue=None, queue_timeout=None):
+        """
+        Update the configuration.  :code:`limits` is merged with the existing limits.
+        """
+        with self._condition:
+            self._limits.update(limits or {})
+            if max_queue is not None:
+                self._max_queue = max_queue
+            if queue_timeout is not None:
+                self._queue_timeout = queue_timeout
+            self._condition.notify_all()
+
+    def reset(self):
+        """
+        Remove all limits.
+        """
+        with self._condition:
+            self._limits = {}
+            self._max_queue = None
+            self._queue_timeout = None
+            self._condition.notify_all()
+
+    def get_limit(self, backend):
+        if backend in self._limits:
+            return self._limits[backend]
+        for pattern, limit in self._limits.items():
+            if fnmatch.fnmatchcase(backend, pattern):
+                return limit
+        return None
+
+    def get_load(self, backend):
+        """
+        Return the number of calls running on and waiting for :code:`backend`.
+        """
+        with self._condition:
+            b = self._backends.get(backend, _Backend())
+            return b.total_running(), len(b.waiting)
+
+    def acquire(self, backend, user=None, priority=None):
+        """
+        Wait until a call can run on :code:`backend` and count it as running.  Returns the user to pass to :code:`release()`.  The user and 
+        priority default to those set with :code:`scheduling()`.
+        """
+        settings = getattr(_scheduling_context, "settings", None) or {}
+        user = user or settings.get("user") or getpass.getuser()
+        priority = priority if priority is not None else settings.get("priority", 0)
+        with self._condition:
+            b = self._backends.setdefault(backend, _Backend())
+            if not self._can_run(backend, b, None):
+                self._wait(backend, b, user, priority)
+            b.running[user] += 1
+        return user
+
+    def release(self, backend, user):
+        with self._condition:
+            b = self._backends[backend]
+            b.running[user] -= 1
+            if b.running[user] == 0:
+                del b.running[user]
+            self._condition.notify_all()
+
+    @contextmanager
+    def admit(self, backend, user=None, priority=None):
+        """
+        Run the body as a call on :code:`backend`.  A :code:`backend` of :code:`None` isn't limited.
+        """
+        if backend is None:
+            yield
+            return
+        user = self.acquire(backend, user, priority)
+        try:
+            yield
+        finally:
+            self.release(backend, user)
+
+    def _can_run(self, backend, b, waiter):
+        limit = self.get_limit(backend)
+        if limit is None:
+            return True
+        if b.total_running() >= limit:
+            return False
+        if not b.waiting:
+            return True
+        return waiter is min(b.waiting, key=lambda w: (-w.priority, b.running[w.user], w.sequence))
+
+    def _wait(self, backend, b, user, priority):
+        if self._max_queue is not None and len(b.waiting) >= self._max_queue:
+            _admission_rejections.inc(backend=backend)
+            raise DelegateFunctionException(f"Too many calls waiting for {backend} ({len(b.waiting)}).")
+        self._sequence += 1
+        waiter = _Waiter(user, priority, self._sequence)
+        b.waiting.append(waiter)
+        start = time.time()
+        try:
+            while not self._can_run(backend, b, waiter):
+                timeout = None
+                if self._queue_timeout is not None:
+                    timeout = start + self._queue_timeout - time.time()
+                    if timeout <= 0:
+                        _admission_rejections.inc(backend=backend)
+                        raise DelegateFunctionException(f"Timed out after {self._queue_timeout}s waiting for {backend}.")
+                self._condition.wait(timeout)
+        finally:
+            b.waiting.remove(waiter)
+            self._condition.notify_all()
+            _admission_wait_seconds.observe(time.time() - start, backend=backend)
+
+
+scheduler = AdmissionScheduler()
+
+
+class HostPool:
+    """
+    Picks a host for each call from a set of equivalent hosts.
+
+    :code:`policy` is either :code:`"least_outstanding"` (fewest calls currently running on the host, ties broken by latency) or 
+    :code:`"latency"` (lowest moving average of measured connection latency, ties broken by outstanding calls).
+
+    Hosts that fail are taken out of rotation for :code:`backoff` seconds, doubling with each consecutive failure up to :code:`max_backoff`.
+    If every host is out of rotation, the one that will come back soonest is used.
+
+    The load and health statistics are kept per host name and shared by every pool in the process, so two chains that use the same
+    host see each other's load.
+    """
+
+    POLICIES = ["least_outstanding", "latency"]
+
+    def __init__(self, hosts, policy="least_outstanding", backoff=30, max_backoff=600, latency_smoothing=0.2):
+        if isinstance(hosts, str):
+            hosts = [hosts]
+        if len(hosts) == 0:
+            raise DelegateFunctionException("HostPool needs at least one host.")
+        if policy not in self.POLICIES:
+            raise DelegateFunctionException(f"Unknown host selection policy '{policy}'.  Choose from {self.POLICIES}.")
+        self._hosts = list(hosts)
+        self._policy = policy
+        self._backoff = backoff
+        self._max_backoff = max_backoff
+        self._latency_smoothing = latency_smoothing
+
+    def get_hosts(self):
+        return self._hosts
+
+    def acquire(self, exclude=()):
+        """
+        Pick a host and count a call as outstanding on it.  Every :code:`acquire()` must be matched with a :code:`release()`.
+        """
+        with _host_stats_lock:
+            candidates = [h for h in self._hosts if h not in exclude] or self._hosts
+            now = time.time()
+            available = [h for h in candidates if self._stats(h).unavailable_until <= now]
+            if available:
+                random.shuffle(available)
+                host = min(available, key=self._sort_key)
+            else:
+                host = min(candidates, key=lambda h: self._stats(h).unavailable_until)
+            self._stats(host).outstanding += 1
+            return host
+
+    def release(self, host, failed=False, latency=None):
+        with _host_stats_lock:
+            stats = self._stats(host)
+            stats.outstanding -= 1
+            if failed:
+                stats.failures += 1
+                delay = min(self._backoff * 2 ** (stats.failures - 1), self._max_backoff)
+                stats.unavailable_until = time.time() + delay
+                log.debug(f"Taking {host} out of rotation for {delay}s after {stats.failures} failure(s)")
+            else:
+                stats.failures = 0
+                stats.unavailable_until = 0
+                if latency is not None:
+                    if stats.latency is None:
+                        stats.latency = latency
+                    else:
+                        stats.latency += self._latency_smoothing * (latency - stats.latency)
+
+    def _sort_key(self, host):
+        stats = self._stats(host)
+        latency = stats.latency if stats.latency is not None else 0
+        if self._policy == "latency":
+            return (latency, stats.outstanding)
+        else:
+            return (stats.outstanding, latency)
+
+    def _stats(self, host):
+        return _host_stats.setdefault(host, _HostStats())
+
+
+_DELTA_MAGIC = b"DFDELTA1"
+_DELTA_MIN_CHUNK = 1 << 8
+_DELTA_MAX_CHUNK = 1 << 16
+_DELTA_CUT_MASK = 0xFFC00000
+_DELTA_GEAR = [random.Random(f"delegate_function gear {i}").getrandbits(32) for i in range(256)]
+
+SYNC_CACHE_MISS_EXIT_CODE = 75
+SYNC_CACHE_MAX_AGE = 24 * 60 * 60
+SYNC_STATE_LIMIT = 16
+
+def _sync_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+def _chunk_boundaries(data):
+    """
+    Split :code:`data` into content-defined chunks with a gear rolling hash.  A chunk ends after a byte where the top bits of the 
+    hash (which only depend on the last 32 bytes) are zero, so boundaries don't move when data is inserted or removed elsewhere.  
+    Chunks are between :code:`_DELTA_MIN_CHUNK` and :code:`_DELTA_MAX_CHUNK` bytes and average about 1.3 KiB, which keeps the
+    damage small when pickle's frame headers (every 64 KiB) move.
+    """
+    gear, mask = _DELTA_GEAR, _DELTA_CUT_MASK
+    start = 0
+    while start < len(data):
+        end = min(len(data), start + _DELTA_MAX_CHUNK)
+        h = 0
+        for i in range(start + _DELTA_MIN_CHUNK, end):
+            h = ((h << 1) + gear[data[i]]) & 0xFFFFFFFF
+            if not h & mask:
+                end = i + 1
+                break
+        yield start, end
+        start = end
+
+def _chunk_digest(view):
+    return hashlib.blake2b(view, digest_size=16).digest()
+
+def _encode_delta(base, new):
+    """
+    Encode :code:`new` as a list of copies out of :code:`base` and literal bytes.
+    """
+    base_view = memoryview(base)
+    index = {}
+    for start, end in _chunk_boundaries(base):
+        index.setdefault(_chunk_digest(base_view[start:end]), (start, end - start))
+
+    ops = []
+    literal = bytearray()
+    new_view = memoryview(new)
+    for start, end in _chunk_boundaries(new):
+        match = index.get(_chunk_digest(new_view[start:end]))
+        if match is None:
+            literal += new_view[start:end]
+            continue
+        if literal:
+            ops.append(bytes(literal))
+            literal = bytearray()
+        if ops and isinstance(ops[-1], tuple) and sum(ops[-1]) == match[0]:
+            ops[-1] = (ops[-1][0], ops[-1][1] + match[1])
+        else:
+            ops.append(match)
+    if literal:
+        ops.append(bytes(literal))
+    return _DELTA_MAGIC + _sync_hash(base).encode() + _sync_hash(new).encode() + pickle.dumps(ops)
+
+def _is_delta(data):
+    return data[:len(_DELTA_MAGIC)] == _DELTA_MAGIC
+
+def _apply_delta(base, delta):
+    header = len(_DELTA_MAGIC)
+    base_hash = delta[header:header + 64].decode()
+    new_hash = delta[header + 64:header + 128].decode()
+    if base is None or _sync_hash(base) != base_hash:
+        raise _SyncCacheMiss("Don't have the image this delta is based on.")
+    base_view = memoryview(base)
+    ops = pickle.loads(delta[header + 128:])
+    new = b"".join(base_view[op[0]:op[0] + op[1]] if isinstance(op, tuple) else op for op in ops)
+    if _sync_hash(new) != new_hash:
+        raise DelegateFunctionException("Applying delta produced a corrupt image.")
+    return new
+
+
+class _SyncCache:
+    """
+    The execution side's cache of the last before and after images it saw for each object, keyed by :code:`key`.
+    """
+    def __init__(self, directory, key, after_base_hash=None):
+        if not re.fullmatch(r"[0-9a-f]+", key):
+            raise DelegateFunctionException(f"Illegal sync key: {key}")
+        self._directory = os.path.expanduser(directory)
+        self._key = key
+        self._after_base_hash = after_base_hash
+        os.makedirs(self._directory, mode=0o700, exist_ok=True)
+        self._prune()
+
+    def resolve_before_image(self, data):
+        if _is_delta(data):
+            data = _apply_delta(self._read("before"), data)
+        self._write("before", data)
+        return data
+
+    def encode_after_image(self, data):
+        base = self._read("after")
+        self._write("after", data)
+        if base is not None and self._after_base_hash == _sync_hash(base):
+            return _encode_delta(base, data)
+        return data
+
+    def _path(self, kind):
+        return os.path.join(self._directory, f"{self._key}.{kind}")
+
+    def _read(self, kind):
+        try:
+            with open(self._path(kind), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _write(self, kind, data):
+        temporary = f"{self._path(kind)}.{os.getpid()}"
+        with open(temporary, "wb") as f:
+            f.write(data)
+        os.replace(temporary, self._path(kind))
+
+    def _prune(self):
+        horizon = time.time() - SYNC_CACHE_MAX_AGE
+        for name in os.listdir(self._directory):
+            path = os.path.join(self._directory, name)
+            try:
+                if os.path.getmtime(path) < horizon:
+                    os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+class _SyncState:
+    """
+    The caller's copy of the last before and after images it exchanged with one host for one object.
+    """
+    def __init__(self):
+        self.key = uuid.uuid4().hex
+        self.before = None
+        self.after = None
+        self.after_hash = None
+
+    def update(self, before, after):
+        self.before = before
+        self.after = after
+        self.after_hash = _sync_hash(after)
+
+_sync_states = collections.OrderedDict()
+_sync_states_lock = threading.Lock()
+
+def _get_sync_state(obj, user, host):
+    key = (id(obj), user, host)
+    with _sync_states_lock:
+        state = _sync_states.pop(key, None) or _SyncState()
+        _sync_states[key] = state
+        while len(_sync_states) > SYNC_STATE_LIMIT:
+            _sync_states.popitem(last=False)
+        return state
+
+
 class SSHDelegate(SubprocessDelegate):
     """
+    :code:`host` can be a single host name or a list of equivalent hosts.  With a list, each call goes to one host picked by a 
+    :class:`HostPool` using :code:`host_selection` (see :class:`HostPool` for the policies).  Hosts we can't reach are skipped 
+    for :code:`host_backoff` seconds (doubling on repeated failures).  If we can't reach a host, the call is retried on another one,
+    since nothing has run remotely yet.
+
+    With :code:`deploy_runner=True`, the runner zipapp (see :class:`SubprocessDelegate`) is uploaded to :code:`remote_runner_directory` 
+    the first time each process uses a host, unless it's already there.
+
+    With :code:`incremental_sync=True`, repeated calls on the same object only send the parts of the before and after images that 
+    changed since the last call to the same host.  The remote side keeps the last images for each object in :code:`sync_cache_directory`,
+    and if it doesn't have the one a delta is based on, we fall back to sending the whole image.
+
     Pitfalls:
 
     1.  Ideally, ssh should work without a password.
     2.  It uses :code:`scp` to create a randomly named temporary directory on the remote host in :code:`/tmp` by default.  It attempts to clean up after itself, but there are no guarantees.
+    3.  Failures after the remote command has started don't take the host out of rotation, because we can't tell them apart from the delegated method failing.
+    4.  With :code:`incremental_sync`, the caller keeps the last images for the :code:`SYNC_STATE_LIMIT` most recently used objects in memory.
 
     """
-    def __init__(self, user, host, *args, ssh_options=None, **kwargs):
+    _same_host = False
+
+    def __init__(self, user, host, *args, ssh_options=None, host_selection="least_outstanding", host_backoff=30, 
+                 incremental_sync=False, sync_cache_directory="~/.cache/delegate_function/sync", 
+                 remote_runner_directory=RUNNER_CACHE_DIRECTORY, **kwargs):
         super().__init__(*args, **kwargs)
+        self._remote_runner_directory = remote_runner_directory
         self._user = user
-        self._host = host
+        self._host_pool = HostPool(host, policy=host_selection, backoff=host_backoff)
+        self._host = self._host_pool.get_hosts()[0]
         if ssh_options is None:
             ssh_options = []
         self._ssh_options = ssh_options
+        self._incremental_sync = incremental_sync
+        self._sync_cache_directory = sync_cache_directory
 
 
     def _run_function_in_external_process(self):
+        tried = []
+        while True:
+            self._host = self._host_pool.acquire(exclude=tried)
+            tried.append(self._host)
+            admitted = False
+            prepared = False
+            connected = False
+            succeeded = False
+            try:
+                user = scheduler.acquire(f"ssh:{self._host}")
+                admitted = True
+                self._compute_remote_file_names()
+                start = time.time()
+                self._prepare_remote_directory()
+                latency = time.time() - start
+                prepared = True
+                self._copy_delegate_before_image()
+                # Deploying the runner doesn't run anything remotely either, so failing here still moves on to another host.
+                self._find_delegate_function_executable()
+                connected = True
+                self._run_remote_command()
+                self._copy_delegate_after_image()
+                succeeded = True
+            except DelegateFunctionException:
+                if not admitted or connected or len(tried) >= len(self._host_pool.get_hosts()):
+                    raise
+                log.warning(f"Couldn't reach {self._host}, retrying on another host.")
+            finally:
+                self._host_pool.release(self._host, 
+                                        failed=admitted and not connected,
+                                        latency=latency if succeeded else None)
+                if prepared:
+                    try:
+                        self._cleanup_remote_directory()
+                    except Exception as e:
+                        # Don't hide why the call failed or stop us from trying another host.
+                        log.warning(f"Couldn't clean up {self._remote_temporary_directory} on {self._host}: {e}")
+                if admitted:
+                    scheduler.release(f"ssh:{self._host}", user)
+            if succeeded:
+                return
+
+    def _admission_backend(self):
+        # We pick the host, and so the backend, in _run_function_in_external_process().
+        return None
+
+    def _run_remote_command(self):
         try:
-            self._compute_remote_file_names()
-            self._prepare_remote_directory()
-            self._copy_delegate_before_image()
             self._invoke_shell(self._compute_command_line())
-            self._copy_delegate_after_image()
-        finally:
-            self._cleanup_remote_directory()
-
+        except DelegateFunctionException as e:
+            if not (self._incremental_sync and 
+                    isinstance(e.__cause__, subprocess.CalledProcessError) and 
+                    e.__cause__.returncode == SYNC_CACHE_MISS_EXIT_CODE):
+                raise
+            log.debug(f"{self._host} doesn't have the base image for our delta.  Sending the whole image.")
+            self._copy_delegate_before_image(full=True)
+            self._invoke_shell(self._compute_command_line())
 
     def _compute_command_line(self):
         return self._compute_ssh_command_line() + [self._find_delegate_function_executable(),
                             "--delegate-before", self._remote_delegate_before_image_name,
                             "--delegate-after", self._remote_delegate_after_image_name,
-                            "--log-level", str(log.root.level)]
+                            "--log-level", str(log.root.level)] + self._compute_sync_args() + self._compute_relay_args()
     
+    def _compute_sync_args(self):
+        if not self._incremental_sync:
+            return []
+        args = ["--sync-cache-directory", self._sync_cache_directory,
+                "--sync-key", self._sync_state.key]
+        if self._sync_state.after_hash is not None:
+            args += ["--sync-after-base-hash", self._sync_state.after_hash]
+        return args
+
 
     def _compute_ssh_command_line(self):
         return ["ssh", *self._ssh_options, ("-t" if self._interactive else "-T"), f"{self._user}@{self._host}"]
 
+    def _output_label(self):
+        return f"{type(self).__name__}({self._user}@{self._host})"
 
-    def _copy_delegate_before_image(self):
+    def _find_delegate_function_executable(self):
+        if not self._deploy_runner:
+            return super()._find_delegate_function_executable()
+        path = f"{self._remote_runner_directory}/{_runner_file_name()}"
+        key = (self._user, self._host, path)
+        if key not in _deployed_runners:
+            if not self._remote_file_exists(path):
+                self._upload_runner(path)
+            _deployed_runners.add(key)
+        return path
+
+    def _remote_file_exists(self, path):
+        try:
+            self._invoke_shell(self._compute_ssh_command_line() + ["test", "-f", path])
+            return True
+        except DelegateFunctionException as e:
+            if isinstance(e.__cause__, subprocess.CalledProcessError) and e.__cause__.returncode == 1:
+                return False
+            raise
+
+    def _upload_runner(self, path):
+        log.debug(f"Uploading runner to {self._host}:{path}")
+        temporary = f"{path}.{uuid.uuid4()}"
+        with tempfile.NamedTemporaryFile(suffix=".pyz") as runner:
+            runner.write(_get_runner_zipapp()[0])
+            runner.flush()
+            self._invoke_shell(self._compute_ssh_command_line() + ["mkdir", "-p", self._remote_runner_directory])
+            self._invoke_shell(['scp', runner.name, f"{self._user}@{self._host}:{temporary}"])
+        self._invoke_shell(self._compute_ssh_command_line() + ["chmod", "755", temporary])
+        self._invoke_shell(self._compute_ssh_command_line() + ["mv", "-f", temporary, path])
+
+
+    def _copy_delegate_before_image(self, full=False):
+        source = self._delegate_before_image_name
+        if self._incremental_sync and not full:
+            source = self._write_delegate_before_delta()
         command = ['scp', 
-                   self._delegate_before_image_name, 
+                   source, 
                    f"{self._user}@{self._host}:{self._remote_delegate_before_image_name}"]
-        self._invoke_shell(command)
+        try:
+            self._invoke_shell(command)
+        finally:
+            if source != self._delegate_before_image_name:
+                os.remove(source)
+        if self._delegate_before_sidecars and not full:
+            self._invoke_shell(['scp', *self._delegate_before_sidecars, f"{self._user}@{self._host}:{self._remote_temporary_directory}/"])
         
     def _copy_delegate_after_image(self):
+        # The glob picks up the after image's sidecars, too.
         command = ['scp', 
-                   f"{self._user}@{self._host}:{self._remote_delegate_after_image_name}", 
-                   self._delegate_after_image_name]
+                   f"{self._user}@{self._host}:{self._remote_delegate_after_image_name}*", 
+                   os.path.dirname(self._delegate_after_image_name)]
         self._invoke_shell(command)
+        if self._incremental_sync:
+            self._resolve_delegate_after_delta()
+
+    def _write_delegate_before_delta(self):
+        self._sync_state = _get_sync_state(self._obj, self._user, self._host)
+        with open(self._delegate_before_image_name, "rb") as f:
+            self._sync_before_image = f.read()
+        if self._sync_state.before is None:
+            return self._delegate_before_image_name
+        delta_name = self._delegate_before_image_name + ".delta"
+        with open(delta_name, "wb") as f:
+            f.write(_encode_delta(self._sync_state.before, self._sync_before_image))
+        return delta_name
+
+    def _resolve_delegate_after_delta(self):
+        with open(self._delegate_after_image_name, "rb") as f:
+            after = f.read()
+        if _is_delta(after):
+            after = _apply_delta(self._sync_state.after, after)
+            with open(self._delegate_after_image_name, "wb") as f:
+                f.write(after)
+        self._sync_state.update(self._sync_before_image, after)
+
+    def __getstate__(self):
+        state = super().__getstate__()
+        # The sync state holds whole images, so shipping it would nest every previous image in the next one.
+        state.pop("_sync_state", None)
+        state.pop("_sync_before_image", None)
+        return state
 
     def _compute_remote_file_names(self):
         self._remote_execution_id = str(uuid.uuid4())
@@ -401,27 +2517,254 @@ class SSHDelegate(SubprocessDelegate):
         self._invoke_shell(self._compute_ssh_command_line() + ["rm","-rf", self._remote_temporary_directory])
 
 
+SLURM_POLL_INTERVAL = 5
+SLURM_AFTER_IMAGE_GRACE = 30
+SLURM_FAILED_STATES = ["BOOT_FAIL", "CANCELLED", "DEADLINE", "FAILED", "NODE_FAIL", "OUT_OF_MEMORY", "PREEMPTED", "TIMEOUT"]
+
+class _SlurmJob:
+    def __init__(self, job_id, delegate, obj, before, after, output, workspace, submitted_at):
+        self.job_id = job_id
+        self.delegate = delegate
+        self.obj = obj
+        self.before = before
+        self.after = after
+        self.output = output
+        self.workspace = workspace
+        self.future = Future()
+        self.finished_at = None
+        self.submitted_at = submitted_at
+
+    def cleanup(self):
+        _remove_files([self.before, self.after, self.output])
+        _remove_sidecars(self.before)
+        _remove_sidecars(self.after)
+
+
+class _SlurmPoller:
+    """
+    A single background thread that tracks every outstanding job from :code:`SlurmDelegate.submit()`.  Every 
+    :code:`SLURM_POLL_INTERVAL` seconds it makes one :code:`squeue` call for all of them, and resolves the future of each job 
+    that has left the queue once its after image has appeared.  For jobs that have left the queue without one, one :code:`sacct`
+    call gets their states.  Those that ended in one of :code:`SLURM_FAILED_STATES` fail right away, and the rest fail if the after 
+    image doesn't appear within :code:`SLURM_AFTER_IMAGE_GRACE` seconds (e.g., because the shared file system is slow).  Failures 
+    include the job's state and the end of its output.
+    """
+    def __init__(self):
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def add(self, job):
+        with self._lock:
+            self._jobs[job.job_id] = job
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="SlurmPoller", daemon=True)
+                self._thread.start()
+        return job.future
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if not self._jobs:
+                    self._thread = None
+                    return
+                jobs = list(self._jobs.values())
+            try:
+                self._poll(jobs)
+            except Exception as e:
+                log.error(f"Polling Slurm jobs failed: {e}")
+            time.sleep(SLURM_POLL_INTERVAL)
+
+    def _poll(self, jobs):
+        cancelled = [j for j in jobs if j.future.cancelled()]
+        if cancelled:
+            self._cancel_jobs([j.job_id for j in cancelled])
+            for j in cancelled:
+                self._finish(j)
+
+        active = self._query_active_jobs()
+        now = time.time()
+        finished = []
+        for j in jobs:
+            if j.future.cancelled() or j.job_id in active:
+                continue
+            if os.path.exists(j.after):
+                self._resolve(j)
+            else:
+                finished.append(j)
+
+        if finished:
+            states = self._query_job_states([j.job_id for j in finished])
+            for j in finished:
+                state = states.get(j.job_id, "unknown")
+                if j.finished_at is None:
+                    j.finished_at = now
+                if state.split(" ")[0] in SLURM_FAILED_STATES:
+                    self._fail(j, f"Slurm job {j.job_id} failed (state: {state}).")
+                elif now - j.finished_at > SLURM_AFTER_IMAGE_GRACE:
+                    self._fail(j, f"Slurm job {j.job_id} finished without producing an after image (state: {state}).")
+
+    def _resolve(self, job):
+        # Once the future is running, it can't be cancelled, so the object is only updated if we set its result.
+        if not job.future.set_running_or_notify_cancel():
+            self._finish(job)
+            return
+        try:
+            _after_image_bytes.observe(os.path.getsize(job.after), **job.delegate._metric_labels())
+            with open(job.after, "rb") as f:
+                with _image_sidecars(job.after):
+                    after = _load_after_image(f)
+            with _workspace_call(job.workspace):
+                r = job.delegate._merge_after_image(after, obj=job.obj)
+            job.workspace.finish()
+        except Exception as e:
+            message = f"Failed to load after image for Slurm job {job.job_id}: {e}{self._read_output(job)}"
+            self._finish(job)
+            job.future.set_exception(DelegateFunctionException(message))
+        else:
+            self._finish(job, failed=False)
+            job.future.set_result(r)
+
+    def _fail(self, job, message):
+        message += self._read_output(job)
+        self._finish(job)
+        if job.future.set_running_or_notify_cancel():
+            job.future.set_exception(DelegateFunctionException(message))
+
+    def _finish(self, job, failed=True):
+        # The call was counted when it was submitted, so this is where its outcome and latency are recorded.
+        labels = job.delegate._metric_labels()
+        if failed:
+            _failures.inc(**labels)
+        _call_seconds.observe(time.time() - job.submitted_at, **labels)
+        job.cleanup()
+        job.workspace.discard()
+        with self._lock:
+            del self._jobs[job.job_id]
+
+    def _read_output(self, job):
+        """
+        The end of the job's output, formatted to append to a message.
+        """
+        try:
+            with open(job.output, "rb") as f:
+                f.seek(max(os.path.getsize(job.output) - OUTPUT_TAIL_BYTES, 0))
+                return f"\nEnd of output:\n{f.read().decode(errors='replace')}"
+        except FileNotFoundError:
+            return ""
+
+    def _query_active_jobs(self):
+        command = ["squeue", "-h", "-o", "%i", "-u", getpass.getuser()]
+        with _timed_command("SlurmDelegate", command):
+            r = subprocess.run(command, check=True, capture_output=True, text=True)
+        return set(r.stdout.split())
+
+    def _query_job_states(self, job_ids):
+        command = ["sacct", "-n", "-P", "-X", "-o", "JobID,State", "-j", ",".join(job_ids)]
+        try:
+            with _timed_command("SlurmDelegate", command):
+                r = subprocess.run(command, capture_output=True, text=True)
+        except OSError as e:
+            log.warning(f"Couldn't get the states of Slurm jobs {job_ids}: {e}")
+            return {}
+        return dict(line.split("|", 1) for line in r.stdout.splitlines() if "|" in line)
+
+    def _cancel_jobs(self, job_ids):
+        command = ["scancel", *job_ids]
+        with _timed_command("SlurmDelegate", command):
+            subprocess.run(command)
+
+_slurm_poller = _SlurmPoller()
+
+
 class SlurmDelegate(SubprocessDelegate):
 
     """
+    :code:`invoke()` blocks until the job finishes.  :code:`submit()` takes the same arguments, but submits the job with :code:`sbatch`
+    and returns a :code:`concurrent.futures.Future` right away.  The future resolves to the method's return value, and the 
+    object is updated when it does.  Cancelling the future cancels the job.
+
     Pitfalls:
 
     1.  Slurm requires a shared file system, and the :code:`temporary_file_root` needs to live in that file system.
+    2.  Objects passed to :code:`submit()` are updated from a background thread when their job finishes.  Don't use them until then.
+    3.  Jobs that are still outstanding when the process exits keep running, but their results are lost.
+
+    Resource hints (see :class:`BaseDelegate`) become :code:`--cpus-per-task`, :code:`--mem`, :code:`--time`, and :code:`--exclusive`,
+    and the defaults can be set with :code:`resources` (e.g., :code:`resources=dict(cpus=2, memory="4G")`).
+
+    :code:`scheduler` limits calls per :code:`partition`.  For :code:`submit()`, that only covers submitting the job, not running it.
 
     """
-    def __init__(self, *args, temporary_file_root=None, **kwargs):
+    _same_host = False
+
+    def __init__(self, *args, temporary_file_root=None, resources=None, partition=None, **kwargs):
         if temporary_file_root is None:
             raise Exception("SlurmDelegate needs 'temporary_file_root' to point to directory in a file system shared between the executing host and Slurm cluster")
         kwargs['temporary_file_root'] = temporary_file_root
         super().__init__(*args, **kwargs)
+        _check_resource_hints(resources)
+        self._resources = resources
+        self._partition = partition
 
     def _compute_command_line(self):
-        return ['salloc', 'srun', '--export=ALL'] + (["--pty"] if self._interactive else []) + super()._compute_command_line()
+        resource_args = _slurm_resource_args(self._get_resources())
+        return ['salloc'] + self._compute_partition_args() + resource_args + ['srun', '--export=ALL'] + resource_args + (["--pty"] if self._interactive else []) + super()._compute_command_line()
+
+    def _compute_partition_args(self):
+        return [] if self._partition is None else [f"--partition={self._partition}"]
+
+    def _admission_backend(self):
+        return f"slurm:{self._partition or 'default'}"
     
     def _run_function_in_external_process(self):
         command = self._compute_command_line()
         self._invoke_shell(command)
 
+    def submit(self, obj, method, *argc, **kwargs):
+        """
+        Submit :code:`obj.method(*argc, **kwargs)` as a batch job and return a future for its result.
+        """
+        self._obj = obj
+        self._method = method
+        self._argc = argc
+        self._kwargs = kwargs
+        self._call_resources = getattr(_resource_context, "hints", None)
+
+        labels = self._metric_labels()
+        _calls.inc(**labels)
+        start = time.time()
+        fd, self._delegate_before_image_name = tempfile.mkstemp(dir=self._temporary_file_root, suffix=".before.pickle")
+        base = self._delegate_before_image_name[:-len(".before.pickle")]
+        self._delegate_after_image_name = base + ".after.pickle"
+        output = base + ".out"
+        workspace = _WorkspaceCall()
+        try:
+            with os.fdopen(fd, "wb") as delegate_before:
+                with _image_sidecars(self._delegate_before_image_name), _workspace_call(workspace):
+                    pickle.dump(self, delegate_before)
+            _before_image_bytes.observe(os.path.getsize(self._delegate_before_image_name), **self._metric_labels())
+            os.chmod(self._delegate_before_image_name, 0o666)
+            with scheduler.admit(self._admission_backend()):
+                job_id = self._submit_batch_job(output)
+        except:
+            os.remove(self._delegate_before_image_name)
+            _remove_sidecars(self._delegate_before_image_name)
+            _failures.inc(**labels)
+            _call_seconds.observe(time.time() - start, **labels)
+            raise
+        log.debug(f"Submitted Slurm job {job_id}")
+        return _slurm_poller.add(_SlurmJob(job_id, self, obj, self._delegate_before_image_name, self._delegate_after_image_name, output, 
+                                           workspace, start))
+
+    def _compute_batch_command_line(self, output):
+        return ['sbatch', '--parsable', '--export=ALL', '--output', output, *self._compute_partition_args(), *_slurm_resource_args(self._get_resources()),
+                '--wrap', shlex.join(SubprocessDelegate._compute_command_line(self, relay_output=False))]
+
+    def _submit_batch_job(self, output):
+        r = self._invoke_shell_output(self._compute_batch_command_line(output))
+        return r.strip().split(";")[0]
+
 
 class DockerDelegate(SubprocessDelegate):
 
@@ -431,10 +2774,14 @@ class DockerDelegate(SubprocessDelegate):
     1.  Docker delegate requires a shared file system.  The :code:`temporary_file_root` needs to be reachable at the same location from outside and inside the docker container.
     2.  `docker_cmd_line_args` is a big security problem. as are any other constructor arguments that control how docker executes.  We probably need a trusted configuration file 
         somewhere that we load to determine how docker should be run.  How do we specify where the config file should live?
+    3.  Of the resource hints (see :class:`BaseDelegate`), only :code:`cpus` and :code:`memory` apply.  They become :code:`--cpus` and 
+        :code:`--memory`.
 
     """
 
-    def __init__(self, docker_image, *argc, temporary_file_root=None, docker_cmd_line_args = None, **kwargs):
+    _same_host = False
+
+    def __init__(self, docker_image, *argc, temporary_file_root=None, docker_cmd_line_args = None, resources=None, **kwargs):
         if temporary_file_root is None:
             raise Exception("DockerDelegate needs 'temporary_file_root' to point to directory visible at the same location inside and outside the docker container")
         kwargs['temporary_file_root'] = temporary_file_root
@@ -445,6 +2792,8 @@ class DockerDelegate(SubprocessDelegate):
             docker_cmd_line_args = []
 
         self._docker_cmd_line_args = docker_cmd_line_args
+        _check_resource_hints(resources)
+        self._resources = resources
 
     def get_docker_cmd_line_args(self):
         return self._docker_cmd_line_args
@@ -454,12 +2803,16 @@ class DockerDelegate(SubprocessDelegate):
         return ['docker', 'run',
                 '--workdir', '/tmp',
                 *(["-it"] if self._interactive else []),
+                *_docker_resource_args(self._get_resources()),
                 *self.get_docker_cmd_line_args(),
                 self._docker_image] +  [self._find_delegate_function_executable(), #"/opt/conda/bin/delegate-function-run",
                 "--delegate-before", self._docker_delegate_before_image_name,
                 "--delegate-after", self._docker_delegate_after_image_name,
-                "--log-level", str(log.root.level)]
+                "--log-level", str(log.root.level)] + self._compute_relay_args()
+
 
+    def _admission_backend(self):
+        return _docker_backend()
 
     def _run_function_in_external_process(self):
         log.debug(f"{self._temporary_file_root=}")
@@ -480,20 +2833,31 @@ class DockerDelegate(SubprocessDelegate):
 
 
 class DelegateFunctionException(Exception):
+    """
+    If a subprocess failed, :code:`stdout_tail` and :code:`stderr_tail` hold the end of its output.
+    """
+    stdout_tail = None
+    stderr_tail = None
+
+class _SyncCacheMiss(DelegateFunctionException):
     pass
 
 class DelegateGenerator(BaseDelegate):
 
-    def __init__(self, filename=None, yaml=None):
-        if filename is not None and yaml is not None:
-            raise Exception("You can't specify both filename and yaml")
+    def __init__(self, filename=None, yaml=None, spec=None):
+        if sum(x is not None for x in [filename, yaml, spec]) > 1:
+            raise Exception("You can only specify one of filename, yaml, and spec")
         if filename is not None:
             self._load_spec_from_file(filename)
         elif yaml is not None:
             self._load_spec_from_string(yaml)
+        elif spec is not None:
+            self._spec = spec
         else:
-            raise Exception("You must specify either filename or yaml")
+            raise Exception("You must specify either filename, yaml, or spec")
         
+        if 'admission' in self._spec:
+            scheduler.configure(**self._expand_env_vars(self._spec['admission']))
         self._delegates = [self._load_delegate(x) for x in self._spec['sequence']]
 
         self._wrapped_delegate = DelegateChain(*self._delegates)()
@@ -502,7 +2866,15 @@ class DelegateGenerator(BaseDelegate):
         self._wrapped_delegate.set_subdelegate(subdelegate)
 
     def invoke(self, obj, method, *argc, **kwargs):
-        self._wrapped_delegate.invoke(obj,method,*argc, **kwargs)
+        return self._wrapped_delegate.invoke(obj,method,*argc, **kwargs)
+
+    @property
+    def _method_seconds(self):
+        return self._wrapped_delegate._method_seconds
+
+    @property
+    def _profile_data(self):
+        return self._wrapped_delegate._profile_data
         
     def _do_invoke(self, *argc, **kwargs):
         return self._wrapped_delegate._do_invoke(*argc, **kwargs)
@@ -511,6 +2883,8 @@ class DelegateGenerator(BaseDelegate):
         return self._wrapped_delegate._delegated_invoke(*argc, **kwargs)
 
     def _load_delegate(self, delegate_spec):
+        if 'parallel' in delegate_spec:
+            delegate_spec = dict(delegate_spec['parallel'], type="ParallelDelegate")
         c = globals().get(delegate_spec['type'])
         if c is None or not issubclass(c, BaseDelegate):
             raise DelegateFunctionException(f"Illegal delegate name: {delegate_spec['type']}")
@@ -519,6 +2893,7 @@ class DelegateGenerator(BaseDelegate):
             del args['type']
             args = self._expand_env_vars(args)
             return c(*argc, **args, **kwargs)
+        Factory.__name__ = delegate_spec['type']
         return Factory
     
     def _load_spec_from_file(self, filename):
@@ -541,11 +2916,366 @@ class DelegateGenerator(BaseDelegate):
             return m
         
 
+class _RouteStats:
+    def __init__(self):
+        self.outstanding = 0
+        self.overhead = None
+        self.runtime = {}
+        self.failures = 0
+        self.unavailable_until = 0
+
+
+_route_stats = {}
+_route_stats_lock = threading.Lock()
+_routed_calls = metrics.counter("delegate_function_routed_calls_total", "Calls sent to each route by RoutingDelegate.")
+
+
+class Route:
+    """
+    One of the chains a :class:`RoutingDelegate` can send calls to, or one of the branches of a :class:`ParallelDelegate`.
+
+    :code:`chain` is a delegate factory (e.g., from :code:`DelegateChain()`) and :code:`sequence` is a list of delegate specs in the
+    same format as a :class:`DelegateGenerator` spec.  Give exactly one of them.
+
+    :code:`tags` describe the route's properties (e.g., :code:`["sandbox"]`) for matching against a call's requirements.
+
+    :code:`slots` is how many calls the route can run at once without slowing down (e.g., the number of cores on the front end).  By 
+    default it's unlimited.
+    """
+    def __init__(self, name, chain=None, sequence=None, tags=None, slots=None):
+        if (chain is None) == (sequence is None):
+            raise DelegateFunctionException(f"Route '{name}' needs exactly one of 'chain' and 'sequence'.")
+        self.name = name
+        self.tags = set(tags or [])
+        self.slots = slots
+        if chain is not None:
+            self._factory = chain
+        else:
+            self._factory = lambda: DelegateGenerator(spec=dict(sequence=sequence))
+
+    def make_delegate(self):
+        return self._factory()
+
+
+def _chain_tail(delegate):
+    delegate = getattr(delegate, "_wrapped_delegate", delegate)
+    while delegate._subdelegate is not None:
+        delegate = getattr(delegate._subdelegate, "_wrapped_delegate", delegate._subdelegate)
+    return delegate
+
+
+class RoutingDelegate(BaseDelegate):
+
+    """
+    Send each call to whichever of several candidate chains is predicted to finish it soonest.
+
+    :code:`routes` is a list of :class:`Route` objects or of dicts with the same arguments, so it can be given in a YAML spec::
+
+        sequence:
+          - type: RoutingDelegate
+            routes:
+              - name: local
+                slots: 4
+                sequence:
+                  - type: TrivialDelegate
+              - name: cluster
+                tags: [sandbox]
+                sequence:
+                  - type: SSHDelegate
+                    user: worker
+                    host: cluster.example.com
+                  - type: SuDockerDelegate
+                    docker_image: sandbox
+            rules:
+              - methods: ["grade*"]
+                requires: [sandbox]
+
+    The prediction for a route is the moving average of its overhead (the call's latency minus the time the method itself ran) plus the
+    moving average of the method's run time on that route.  If the method hasn't run on the route yet, its fastest run time on any 
+    route is used instead.  Routes that have never been used are predicted to cost nothing, so each one gets tried.  If the route has
+    :code:`slots`, the run time is multiplied by the number of rounds of calls already waiting for it.  Ties go to the route listed first.
+
+    Routes whose calls fail are taken out of rotation for :code:`backoff` seconds, doubling with each consecutive failure up to 
+    :code:`max_backoff`, and the time a failed call took counts toward the route's overhead.  If every eligible route is out of 
+    rotation, the one that will come back soonest is used.
+
+    Calls may only go to routes that have all the tags the call requires.  Those come from the :code:`rules` whose :code:`methods` 
+    patterns (shell-style, matched against :code:`method` and :code:`Class.method`) match, and from the object's class, which can 
+    map method names to required tags with a :code:`delegate_function_requires` attribute (e.g., 
+    :code:`delegate_function_requires = dict(grade=["sandbox"])`).  If no route qualifies, the call fails.
+
+    Pitfalls:
+
+    1.  Statistics are kept per route name and shared by every :class:`RoutingDelegate` in the process, so routes with the same name
+        need to be the same chain.
+    2.  A route's chain is built fresh for each call.  If the routing delegate has a sub-delegate, it's appended to the end of the chain.
+    3.  The statistics live in the calling process, so put the routing delegate near the front of your chain.
+    """
+
+    def __init__(self, *argc, routes=None, rules=None, smoothing=0.2, backoff=30, max_backoff=600, **kwargs):
+        super().__init__(*argc, **kwargs)
+        if not routes:
+            raise DelegateFunctionException("RoutingDelegate needs at least one route.")
+        self._routes = [Route(**r) if isinstance(r, dict) else r for r in routes]
+        self._rules = rules or []
+        self._smoothing = smoothing
+        self._backoff = backoff
+        self._max_backoff = max_backoff
+        self._route_name = None
+
+    def get_routes(self):
+        return self._routes
+
+    def get_route_name(self):
+        """
+        The name of the route used for the last call.
+        """
+        return self._route_name
+
+    def _do_invoke(self):
+        self._execute_debug_pre_hook()
+        key = f"{type(self._obj).__qualname__}.{self._method}"
+        route = self._choose_route(key)
+        self._route_name = route.name
+        _routed_calls.inc(route=route.name, **self._metric_labels())
+        log.debug(f"Routing {key} to {route.name}")
+
+        start = time.time()
+        try:
+            delegate = route.make_delegate()
+            if self._subdelegate is not None:
+                _chain_tail(delegate).set_subdelegate(self._subdelegate)
+            r = delegate.invoke(self._obj, self._method, *self._argc, **self._kwargs)
+        except:
+            self._record_failure(route, time.time() - start)
+            raise
+        finally:
+            with _route_stats_lock:
+                _route_stats[route.name].outstanding -= 1
+        self._method_seconds = delegate._method_seconds
+        self._profile_data = delegate._profile_data
+        self._record(route, key, time.time() - start, self._method_seconds)
+        return r
+
+    def _required_tags(self):
+        names = [self._method, f"{type(self._obj).__qualname__}.{self._method}"]
+        required = set()
+        for rule in self._rules:
+            if any(fnmatch.fnmatchcase(n, p) for n in names for p in rule['methods']):
+                required |= set(rule['requires'])
+        required |= set((getattr(self._obj, "delegate_function_requires", None) or {}).get(self._method, []))
+        return required
+
+    def _choose_route(self, key):
+        required = self._required_tags()
+        eligible = [r for r in self._routes if required <= r.tags]
+        if not eligible:
+            raise DelegateFunctionException(f"No route for {key} has all of the required tags {sorted(required)}.")
+        with _route_stats_lock:
+            now = time.time()
+            available = [r for r in eligible if self._stats(r).unavailable_until <= now]
+            if available:
+                route = min(available, key=lambda r: self._predict(r, key))
+            else:
+                route = min(eligible, key=lambda r: self._stats(r).unavailable_until)
+            self._stats(route).outstanding += 1
+        return route
+
+    def _predict(self, route, key):
+        stats = self._stats(route)
+        if stats.overhead is None:
+            return 0
+        runtime = stats.runtime.get(key)
+        if runtime is None:
+            runtime = min((s.runtime[key] for s in _route_stats.values() if key in s.runtime), default=0)
+        if route.slots:
+            runtime *= 1 + stats.outstanding // route.slots
+        return stats.overhead + runtime
+
+    def _record(self, route, key, elapsed, method_seconds):
+        if method_seconds is None:
+            method_seconds = elapsed
+        overhead = max(elapsed - method_seconds, 0)
+        with _route_stats_lock:
+            stats = self._stats(route)
+            stats.overhead = self._smooth(stats.overhead, overhead)
+            stats.runtime[key] = self._smooth(stats.runtime.get(key), method_seconds)
+            stats.failures = 0
+            stats.unavailable_until = 0
+
+    def _record_failure(self, route, elapsed):
+        with _route_stats_lock:
+            stats = self._stats(route)
+            stats.overhead = self._smooth(stats.overhead, elapsed)
+            stats.failures += 1
+            delay = min(self._backoff * 2 ** (stats.failures - 1), self._max_backoff)
+            stats.unavailable_until = time.time() + delay
+            log.debug(f"Taking route {route.name} out of rotation for {delay}s after {stats.failures} failure(s)")
+
+    def _smooth(self, average, value):
+        if average is None:
+            return value
+        return average + self._smoothing * (value - average)
+
+    def _stats(self, route):
+        return _route_stats.setdefault(route.name, _RouteStats())
+
+
+def _copy_object(obj):
+    """
+    Copy :code:`obj` the way shipping it to a delegate would:  its input attributes are copied, its local ones are shared, and the 
+    rest are left out (see :code:`delegate_function_attributes`).  Objects without a shipping spec go through their own pickling.
+    """
+    spec = _get_shipping_spec(obj)
+    if spec is None:
+        return pickle.loads(pickle.dumps(obj))
+    state = pickle.loads(pickle.dumps(_select_attributes(obj, "inputs")))
+    state.update((k, v) for k, v in obj.__dict__.items() if k in spec.get("local", []))
+    return _rebuild_object(type(obj), state)
+
+def _resolve_function(f):
+    if not isinstance(f, str):
+        return f
+    module, _, name = f.replace(":", ".").rpartition(".")
+    return getattr(importlib.import_module(module), name)
+
+
+class ParallelDelegate(BaseDelegate):
+
+    """
+    Run the same call concurrently on several chains (e.g., one per host or per docker image).
+
+    :code:`branches` is a list of :class:`Route` objects or of dicts with the same arguments (the names are optional).  In a YAML spec,
+    it's a :code:`parallel` stage::
+
+        sequence:
+          - parallel:
+              collect: list
+              branches:
+                - sequence:
+                    - type: SSHDelegate
+                      user: bench
+                      host: skylake
+                - sequence:
+                    - type: SSHDelegate
+                      user: bench
+                      host: zen4
+
+    :code:`collect` says what the call returns:
+
+    * :code:`list`:  A list of the branches' return values, in the order of :code:`branches`.
+    * :code:`first`:  The return value of the first branch to succeed.  The other branches keep running in the background.
+    * :code:`reduce`:  The branches' return values combined with :code:`functools.reduce()` and :code:`reduce`, which is a function or 
+      its dotted name (e.g., :code:`"operator.add"`).
+
+    The delegates before the stage run once, and the stage starts one thread per branch where it runs.  If the stage has a 
+    sub-delegate, each branch gets its own copy of it appended to its chain.
+
+    With :code:`list` and :code:`reduce`, :code:`profiling()` gets the combined profiles of all the branches.  With :code:`first`, it
+    gets the winning branch's.
+
+    Pitfalls:
+
+    1.  Each branch works on its own copy of the object, which is made the way shipping it to a delegate would be (see 
+        :class:`BaseDelegate`), so attributes declared :code:`local` are shared.  With :code:`first`, the winning branch's changes to 
+        the object and to :class:`TemporaryDirectoryDelegate` workspaces are kept.  Otherwise, they're discarded.
+    2.  With :code:`list` and :code:`reduce`, the call fails if any branch does.  With :code:`first`, it fails if all of them do.
+    """
+
+    COLLECT = ["list", "first", "reduce"]
+
+    def __init__(self, *argc, branches=None, collect="list", reduce=None, **kwargs):
+        super().__init__(*argc, **kwargs)
+        if not branches:
+            raise DelegateFunctionException("ParallelDelegate needs at least one branch.")
+        if collect not in self.COLLECT:
+            raise DelegateFunctionException(f"Unknown collect mode '{collect}'.  Choose from {self.COLLECT}.")
+        if collect == "reduce" and reduce is None:
+            raise DelegateFunctionException("ParallelDelegate needs 'reduce' when collect is 'reduce'.")
+        self._branches = [Route(**dict(dict(name=f"branch{i}"), **b)) if isinstance(b, dict) else b for i, b in enumerate(branches)]
+        self._collect = collect
+        self._reduce = reduce
+
+    def get_branches(self):
+        return self._branches
+
+    def _do_invoke(self):
+        self._execute_debug_pre_hook()
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=len(self._branches))
+        try:
+            scheduling_settings = getattr(_scheduling_context, "settings", None)
+            futures = [executor.submit(self._invoke_branch, b, scheduling_settings) for b in self._branches]
+            if self._collect == "first":
+                return self._collect_first(futures)
+            results = []
+            try:
+                for branch, future in zip(self._branches, futures):
+                    try:
+                        results.append(future.result())
+                    except Exception as e:
+                        raise DelegateFunctionException(f"Branch '{branch.name}' of {type(self).__name__} failed: {e}") from e
+            finally:
+                # The branches' changes are discarded, including the ones from branches that haven't finished.
+                for future in futures:
+                    future.add_done_callback(_discard_branch_workspace)
+            self._method_seconds = max((d._method_seconds or 0) for r, d, obj, workspace in results)
+            self._profile_data = _merge_profile_data([d._profile_data for r, d, obj, workspace in results])
+            values = [r for r, d, obj, workspace in results]
+            if self._collect == "reduce":
+                return functools.reduce(_resolve_function(self._reduce), values)
+            return values
+        finally:
+            executor.shutdown(wait=False)
+
+    def _collect_first(self, futures):
+        errors = []
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                r, delegate, obj, workspace = future.result()
+            except Exception as e:
+                errors.append(e)
+                continue
+            self._obj.__dict__.update(_select_attributes(obj, "outputs"))
+            self._method_seconds = delegate._method_seconds
+            self._profile_data = delegate._profile_data
+            _workspace_context.call.merge(workspace)
+            for other in futures:
+                if other is not future:
+                    other.add_done_callback(_discard_branch_workspace)
+            return r
+        raise DelegateFunctionException(f"All branches of {type(self).__name__} failed: {[str(e) for e in errors]}") from errors[-1]
+
+    def _invoke_branch(self, branch, scheduling_settings):
+        # Thread-locals don't carry over into the worker thread, so re-establish the ones the branch needs.
+        # Each branch collects its own workspace changes, so we can pick the ones to keep.
+        with resource_hints(**(self._call_resources or {})), _profile_options(self._profile_options), \
+             scheduling(**(scheduling_settings or {})), _workspace_call(_WorkspaceCall()) as workspace:
+            delegate = branch.make_delegate()
+            if self._subdelegate is not None:
+                _chain_tail(delegate).set_subdelegate(copy.deepcopy(self._subdelegate))
+            obj = _copy_object(self._obj)
+            r = delegate.invoke(obj, self._method, *self._argc, **self._kwargs)
+        return r, delegate, obj, workspace
+
+def _discard_branch_workspace(future):
+    if not future.cancelled() and future.exception() is None:
+        future.result()[3].discard()
+
+
 @click.command()
 @click.option('--delegate-before', required=True, help="File with the initial state of the delegate.")
 @click.option('--delegate-after', required=True, help="File with delegate state after execution")
 @click.option('--log-level', default=None, type=int, help="Verbosity level for logging.")
-def delegate_function_run(delegate_before, delegate_after, log_level):
+@click.option('--shared-memory-directory', default=None, help="Directory for returning large buffers through shared memory.")
+@click.option('--shared-memory-threshold', default=None, type=int, help="Size in bytes above which buffers go through shared memory.")
+@click.option('--sync-cache-directory', default=None, help="Directory for caching images for incremental synchronization.")
+@click.option('--sync-key', default=None, help="Key identifying the object for incremental synchronization.")
+@click.option('--sync-after-base-hash', default=None, help="Hash of the after image the caller already has.")
+@click.option('--relay-output', is_flag=True, help="Tag the output of the processes our delegates start for the caller's delegate.")
+def delegate_function_run(delegate_before, delegate_after, log_level, shared_memory_directory, shared_memory_threshold,
+                          sync_cache_directory, sync_key, sync_after_base_hash, relay_output):
+    global _relaying_output
+    _relaying_output = relay_output
     import platform
     log.basicConfig(format='%(asctime)s %(levelname)s %(module)s - %(funcName)s: %(message)s')
 #                    datefmt="%Y-%m-%d %H:%M:%S.%f")
@@ -555,9 +3285,26 @@ def delegate_function_run(delegate_before, delegate_after, log_level):
 
     log.info(f"Executing in delegate process on {platform.node()}")
     try:
-        with open(delegate_before, "rb") as delegate_before_stream:
-            with open(delegate_after, "wb") as delegate_after_stream:
-                do_delegate_function_run(delegate_before_stream, delegate_after_stream)
+        sync_cache = None
+        if sync_cache_directory is not None:
+            sync_cache = _SyncCache(sync_cache_directory, sync_key, after_base_hash=sync_after_base_hash)
+        # Write the after image under another name and move it into place, so it never exists half-written (SlurmDelegate.submit() 
+        # takes its existence to mean the call is done).
+        temporary = f"{delegate_after}.{os.getpid()}.tmp"
+        try:
+            with open(delegate_before, "rb") as delegate_before_stream:
+                with open(temporary, "wb") as delegate_after_stream:
+                    do_delegate_function_run(delegate_before_stream, delegate_after_stream,
+                                             shared_memory_directory=shared_memory_directory,
+                                             shared_memory_threshold=shared_memory_threshold,
+                                             sync_cache=sync_cache,
+                                             after_path=delegate_after)
+            os.replace(temporary, delegate_after)
+        finally:
+            _remove_files([temporary])
+    except _SyncCacheMiss as e:
+        log.info(e)
+        sys.exit(SYNC_CACHE_MISS_EXIT_CODE)
     except DelegateFunctionException as e:
         log.error(e)
         sys.exit(1)
@@ -567,17 +3314,92 @@ def delegate_function_run(delegate_before, delegate_after, log_level):
         log.error(e)
         sys.exit(1)
      
-def do_delegate_function_run(delegate_before, delegate_after):
+def do_delegate_function_run(delegate_before, delegate_after, shared_memory_directory=None, shared_memory_threshold=None, sync_cache=None,
+                             after_path=None):
+    before_path = getattr(delegate_before, "name", None)
+    if after_path is None:
+        after_path = getattr(delegate_after, "name", None)
+    if sync_cache is not None:
+        delegate_before = io.BytesIO(sync_cache.resolve_before_image(delegate_before.read()))
     try:
-        delegate_object = pickle.load(delegate_before)
+        with _image_sidecars(before_path):
+            delegate_object = pickle.load(delegate_before)
     except Exception as e:
         raise DelegateFunctionException(f"Failed to load pickled delegate: {e}")
-    r = delegate_object._delegated_invoke()
-    pickle.dump(dict(delegate=delegate_object, return_value=r), delegate_after)
+    with _workspace_call(_WorkspaceCall()):
+        r = delegate_object._delegated_invoke()
+        after = delegate_object._make_after_image(r)
+    with _image_sidecars(after_path):
+        if sync_cache is None:
+            _dump_after_image(after, delegate_after, shared_memory_directory, shared_memory_threshold)
+        else:
+            buffer = io.BytesIO()
+            _dump_after_image(after, buffer, shared_memory_directory, shared_memory_threshold)
+            delegate_after.write(sync_cache.encode_after_image(buffer.getvalue()))
 #    os.chmod(delegate_after, 0o444)
 #    breakpoint()
 
 
+@click.command()
+@click.option('--fd', required=True, type=int, help="File descriptor of the listening socket.")
+@click.option('--preload', multiple=True, help="Module to import before forking any children.")
+@click.option('--log-level', default=None, type=int, help="Verbosity level for logging.")
+def delegate_function_fork_server(fd, preload, log_level):
+    log.basicConfig(format='%(asctime)s %(levelname)s %(module)s - %(funcName)s: %(message)s')
+    if log_level is not None:
+        log.root.setLevel(log_level)
+
+    for m in preload:
+        log.debug(f"Fork server preloading {m}")
+        importlib.import_module(m)
+
+    listener = socket.socket(fileno=fd)
+    do_delegate_function_fork_server(listener, sys.stdin)
+
+def do_delegate_function_fork_server(listener, control):
+    log.info(f"Fork server running in process {os.getpid()} on {platform.node()}")
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN) # Reap children automatically.
+    while True:
+        ready, _, _ = select.select([listener, control], [], [])
+        if control in ready:
+            log.info("Fork server shutting down")
+            return
+        conn, _ = listener.accept()
+        if os.fork() == 0:
+            status = 0
+            try:
+                listener.close()
+                signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+                _fork_server_child(conn)
+            except BaseException:
+                traceback.print_exc()
+                status = 1
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os._exit(status)
+        conn.close()
+
+def _fork_server_child(conn):
+    with conn:
+        try:
+            with _image_sidecars(None):
+                request = pickle.loads(_recv_all(conn))
+            os.chdir(request['cwd'])
+            os.environ.clear()
+            os.environ.update(request['environ'])
+            log.root.setLevel(request['log_level'])
+            delegate_object = request['delegate']
+            with _workspace_call(_WorkspaceCall()):
+                r = delegate_object._delegated_invoke()
+                after = delegate_object._make_after_image(r)
+            with _image_sidecars(None):
+                reply = pickle.dumps(after)
+        except Exception:
+            reply = pickle.dumps(dict(error=traceback.format_exc()))
+        conn.sendall(reply)
+
+
 # These are for testing.  They are here because the need to install on the remote side, 
 # and the classes in test_*.py don't get installed over there.
 class TestClass():
@@ -592,6 +3414,110 @@ class TestClass():
     def set_value(self, v):
         self._value = v
 
+class AttributeShippingClass():
+    delegate_function_attributes = dict(inputs=["_input"], outputs=["_output"], local=["_lock"])
+
+    def __init__(self):
+        self._input = 1
+        self._output = None
+        self._lock = threading.Lock() # Can't be pickled.
+
+    def compute(self):
+        self._output = self._input * 2
+        self._input = 100
+
+class ProfileTestClass():
+    def work(self, n):
+        self._blocks = [bytearray(1024) for i in range(n)]
+        return sorted(range(n), reverse=True)[0]
+
+class BigResultClass():
+    def __init__(self):
+        self._buffer = None
+
+    def make(self, size):
+        self._buffer = io.BytesIO(b"b" * size)
+        self._buffer.seek(10)
+        return b"r" * size, bytearray(size), b"small"
+
+class WorkspaceTestClass():
+    def edit(self):
+        with open("input.txt") as f:
+            r = f.read()
+        with open("output.txt", "w") as f:
+            f.write(r.upper())
+        with open("subdir/modify.txt", "a") as f:
+            f.write(" modified")
+        os.remove("delete_me.txt")
+        shutil.rmtree("delete_me")
+        os.mkdir("empty")
+        return r
+
+class CustomPickleClass():
+    """
+    Drops its generator when it's pickled and makes a new one when it's unpickled.
+    """
+    def __init__(self):
+        self._items = [1, 2, 3]
+        self._iterator = iter(self._items)
+        self._generator = (i for i in self._items)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_generator"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._generator = (i for i in self._items)
+
+    def size(self):
+        self._items.append(len(self._items) + 1)
+        return len(self._items)
+
+class ResourceTestClass(TestClass):
+    delegate_function_resources = dict(set_value=dict(cpus=8, time=90))
+
+class RoutingTestClass(TestClass):
+    delegate_function_requires = dict(untrusted=["sandbox"])
+
+    def untrusted(self):
+        return os.getpid()
+
+class LazyTestClass():
+    def __init__(self, size):
+        self._small = 1
+        self._big = b"b" * size
+        self._other_big = [b"o" * size]
+
+    def loaded(self):
+        return sorted(self.__dict__)
+
+    def use_big(self):
+        self._small = len(self._big)
+        return sorted(self.__dict__)
+
+class ChattyClass():
+    def chatter(self, lines, fail=False):
+        for i in range(lines):
+            print(f"out {i}")
+            print(f"err {i}", file=sys.stderr)
+        print("x" * (OUTPUT_MAX_LINE * 2 + 1), end="")
+        if fail:
+            raise Exception("Chatty failure")
+        return lines
+
+class ParallelTestClass(TestClass):
+    def where(self):
+        self._value += 1
+        return os.getpid()
+
+    def fail_in(self, pid):
+        if os.getpid() == pid:
+            raise Exception(f"Failing in process {pid}")
+        self._value = os.getpid()
+        return os.getpid()
+
 class ShellCommandClass():
     def __init__(self, *args, env=None, **kwargs):
         self._args = args
@@ -18,6 +18,14 @@ def TestSubProcessDelegate(**kwargs):
     r.__name__ = "TestSubProcessDelegateFactory"
     return r
 
+def TestForkServerDelegate(**kwargs):
+    def r(subdelegate=None, **morekwargs):
+        return ForkServerDelegate(subdelegate=subdelegate, 
+                                  preload_modules=["yaml"],
+                                  **kwargs, **morekwargs)
+    r.__name__ = "TestForkServerDelegateFactory"
+    return r
+
 def TestDockerDelegate(**kwargs):
     def r(subdelegate=None, **morekwargs):
         return DockerDelegate("cfiddle-slurm:21.08.6.1",
@@ -69,6 +77,7 @@ def TestSSHDelegate(**kwargs):
     return r
 
 chains_to_test = [TestTrivialDelegate(),
+                  TestForkServerDelegate(),
                   TestSubProcessDelegate(),#debug_pre_hook=(ShellCommandClass(['bash']), "run", [], {}), interactive=True),
                   TestSlurmDelegate(),#debug_pre_hook=(ShellCommandClass(['bash']), "run", [], {}), interactive=True),
                   # Sudo requires you to intstall delegate_function without -e.
@@ -82,6 +91,8 @@ chains_to_test = [TestTrivialDelegate(),
                 DelegateChain(TestTrivialDelegate(),
                                 TestSubProcessDelegate(),
                                 TestTrivialDelegate()),
+                DelegateChain(TestForkServerDelegate(),
+                                TestSubProcessDelegate()),
                 DelegateChain(TestSSHDelegate(),#interactive=True),#debug_pre_hook=(ShellCommandClass(['bash']), "run", [], {}), interactive=True),
                                 TestDockerDelegate()),#debug_pre_hook=(ShellCommandClass(['bash']), "run", [], {}), interactive=True)),
                 DelegateChain(TestSudoDelegate(),
@@ -170,3 +181,670 @@ def test_interactive_disable(mocker):
         assert spy.call_count == 1
 
 
+
+def test_fork_server_failure():
+    sd = TestForkServerDelegate()()
+    with pytest.raises(DelegateFunctionException):
+        sd.invoke(TestClass(), "no_such_method")
+
+def test_fork_server_reuse():
+    import delegate_function
+    sd = TestForkServerDelegate()()
+    assert sd.invoke(TestClass(), "hello") != sd.invoke(TestClass(), "hello")
+    server = delegate_function._get_fork_server(["yaml"])
+    sd.invoke(TestClass(), "hello")
+    assert delegate_function._get_fork_server(["yaml"]) is server
+
+def test_fork_server_connection_lost(mocker):
+    mocker.patch("delegate_function._recv_all", side_effect=ConnectionResetError(104, "Connection reset by peer"))
+    with pytest.raises(DelegateFunctionException):
+        TestForkServerDelegate()().invoke(TestClass(), "hello")
+
+def test_host_pool_least_outstanding():
+    pool = HostPool(["pool-a", "pool-b"])
+    first = pool.acquire()
+    second = pool.acquire()
+    assert first != second
+    pool.release(first)
+    assert pool.acquire() == first
+    pool.release(first)
+    pool.release(second)
+
+def test_host_pool_backoff():
+    pool = HostPool(["backoff-a", "backoff-b"], backoff=60)
+    pool.release(pool.acquire(exclude=["backoff-b"]), failed=True)
+    for i in range(4):
+        h = pool.acquire()
+        assert h == "backoff-b"
+        pool.release(h)
+
+def test_ssh_host_failover(mocker):
+    sd = SSHDelegate("test_fiddler", ["failover-down", "failover-up"])
+    sd._delegate_before_image_name = "/tmp/test.before.pickle"
+    sd._delegate_after_image_name = "/tmp/test.after.pickle"
+    def fake_shell(cmd):
+        if sd._host == "failover-down":
+            raise DelegateFunctionException("unreachable")
+    mocker.patch.object(sd, "_invoke_shell", side_effect=fake_shell)
+    sd._run_function_in_external_process()
+    sd._run_function_in_external_process()
+    assert sd._host == "failover-up"
+
+def test_ssh_host_failover_cleanup_and_deploy(mocker):
+    sd = SSHDelegate("test_fiddler", ["deploy-down", "deploy-up"], deploy_runner=True)
+    sd._delegate_before_image_name = "/tmp/test.before.pickle"
+    sd._delegate_after_image_name = "/tmp/test.after.pickle"
+    mocker.patch("delegate_function._deployed_runners", set())
+    def fake_shell(cmd):
+        if "rm" in cmd:
+            raise DelegateFunctionException("cleanup failed")
+        if sd._host == "deploy-down" and "test" in cmd:
+            raise DelegateFunctionException("deploy failed")
+    mocker.patch.object(sd, "_invoke_shell", side_effect=fake_shell)
+    sd._run_function_in_external_process()
+    assert sd._host == "deploy-up"
+
+@pytest.mark.parametrize("factory", [TestSubProcessDelegate(), TestForkServerDelegate()], ids=["subprocess", "fork_server"])
+def test_attribute_shipping(factory):
+    sd = factory()
+    f = AttributeShippingClass()
+    lock = f._lock
+    sd.invoke(f, "compute")
+    assert f._output == 2
+    assert f._input == 1
+    assert f._lock is lock
+
+@pytest.mark.parametrize("factory", [TestSubProcessDelegate(), TestForkServerDelegate()], ids=["subprocess", "fork_server"])
+def test_custom_pickling(factory):
+    f = CustomPickleClass()
+    assert factory().invoke(f, "size") == 4
+    assert f._items == [1, 2, 3, 4]
+    assert list(f._generator) == [1, 2, 3, 4]
+
+def test_attribute_shipping_bad_spec():
+    class BadSpec:
+        delegate_function_attributes = dict(inputs=[], bogus=[])
+    sd = TestSubProcessDelegate()()
+    with pytest.raises(DelegateFunctionException):
+        sd.invoke(BadSpec(), "__init__")
+
+def test_shared_memory_results(mocker):
+    mkdtemp = mocker.spy(tempfile, "mkdtemp")
+    sd = TestSubProcessDelegate(shared_memory_threshold=1024)()
+    f = BigResultClass()
+    r, ba, small = sd.invoke(f, "make", 1 << 20)
+    assert r == b"r" * (1 << 20)
+    assert ba == bytearray(1 << 20)
+    assert small == b"small"
+    assert f._buffer.getvalue() == b"b" * (1 << 20)
+    assert f._buffer.tell() == 10
+    segments = [d for c, d in zip(mkdtemp.call_args_list, mkdtemp.spy_return_list) if c.kwargs.get("dir") == SHARED_MEMORY_ROOT]
+    assert len(segments) == 1
+    assert not os.path.exists(segments[0])
+
+def test_shared_memory_same_host_only():
+    with pytest.raises(DelegateFunctionException):
+        TestSlurmDelegate(shared_memory_threshold=1024)()
+
+def test_sync_delta_round_trip():
+    import delegate_function
+    base = pickle.dumps([os.urandom(100) for i in range(10000)])
+    new = pickle.loads(base)
+    new[5000] = b"changed"
+    new.insert(10, b"inserted")
+    new = pickle.dumps(new)
+    delta = delegate_function._encode_delta(base, new)
+    assert len(delta) < len(new) / 10
+    assert delegate_function._apply_delta(base, delta) == new
+    with pytest.raises(DelegateFunctionException):
+        delegate_function._apply_delta(new, delta)
+
+def test_sync_delta_text():
+    import delegate_function
+    words = [f"line {i} of the log\n" for i in range(100000)]
+    base = pickle.dumps("".join(words))
+    new = pickle.dumps("!" + "".join(words))
+    delta = delegate_function._encode_delta(base, new)
+    assert len(delta) < len(new) / 10
+    assert delegate_function._apply_delta(base, delta) == new
+
+def fake_ssh(mocker, commands=None, uploaded=None):
+    """
+    Make :code:`SSHDelegate` run its remote commands here, with the remote paths on this machine.  Appends the commands to 
+    :code:`commands` and the sizes of the files :code:`scp` uploads to :code:`uploaded`.
+    """
+    def fake_shell(self, cmd):
+        remote = f"{self._user}@{self._host}:"
+        if commands is not None:
+            commands.append(cmd)
+        if cmd[0] == "scp":
+            if uploaded is not None and not cmd[1].startswith(remote):
+                uploaded.append(os.path.getsize(cmd[1]))
+            for source in glob.glob(cmd[1].replace(remote, "")):
+                shutil.copy(source, cmd[2].replace(remote, ""))
+        else:
+            try:
+                subprocess.run(cmd[cmd.index(remote[:-1]) + 1:], check=True)
+            except subprocess.CalledProcessError as e:
+                raise DelegateFunctionException(f"{e}") from e
+    mocker.patch.object(SSHDelegate, "_invoke_shell", autospec=True, side_effect=fake_shell)
+
+def test_ssh_incremental_sync(mocker, tmp_path):
+    sd = TestSSHDelegate(incremental_sync=True, sync_cache_directory=str(tmp_path / "cache"))()
+    uploaded = []
+    fake_ssh(mocker, uploaded=uploaded)
+
+    f = TestClass()
+    sd.invoke(f, "set_value", os.urandom(1 << 20))
+    sd.invoke(f, "set_value", f._value + b"more")
+    sd.invoke(f, "set_value", f._value + b"even more")
+    assert f._value.endswith(b"moreeven more")
+    assert uploaded[2] < uploaded[0] / 10
+
+    shutil.rmtree(tmp_path / "cache")
+    sd.invoke(f, "set_value", 4)
+    assert f._value == 4
+
+    # Once the object holds a payload, the full before image shouldn't grow from call to call.
+    sd = TestSSHDelegate(incremental_sync=True, sync_cache_directory=str(tmp_path / "cache"))()
+    f = TestClass()
+    full = []
+    write_delta = SSHDelegate._write_delegate_before_delta
+    def record_size(self):
+        full.append(os.path.getsize(self._delegate_before_image_name))
+        return write_delta(self)
+    mocker.patch.object(SSHDelegate, "_write_delegate_before_delta", autospec=True, side_effect=record_size)
+    for i in range(5):
+        sd.invoke(f, "set_value", os.urandom(100000))
+    assert max(full[1:]) < min(full[1:]) * 1.1
+
+def test_slurm_submit(mocker, tmp_path):
+    def fake_sbatch(self, cmd):
+        subprocess.run(shlex.split(cmd[-1]), check=True)
+        fake_sbatch.count += 1
+        return f"{fake_sbatch.count};cluster\n"
+    fake_sbatch.count = 0
+    metrics.reset()
+    mocker.patch.object(SlurmDelegate, "_invoke_shell_output", autospec=True, side_effect=fake_sbatch)
+    mocker.patch("delegate_function._SlurmPoller._query_active_jobs", return_value=set())
+    mocker.patch("delegate_function.SLURM_POLL_INTERVAL", 0.1)
+    sd = SlurmDelegate(temporary_file_root=str(tmp_path), delegate_executable_path="/opt/conda/bin/delegate-function-run")
+    objects = [TestClass() for i in range(4)]
+    futures = [sd.submit(f, "set_value", i) for i, f in enumerate(objects)]
+    for f in futures:
+        f.result(timeout=30)
+    assert [f._value for f in objects] == [0, 1, 2, 3]
+    assert os.listdir(tmp_path) == []
+    assert metrics.get_metric("delegate_function_calls_total").get(**sd._metric_labels()) == 4
+    assert metrics.get_metric("delegate_function_call_seconds").get(**sd._metric_labels())['count'] == 4
+    assert not metrics.get_metric("delegate_function_failures_total").get(**sd._metric_labels())
+
+def test_slurm_submit_failure(mocker, tmp_path):
+    def fake_sbatch(self, cmd):
+        with open(cmd[cmd.index("--output") + 1], "w") as output:
+            subprocess.run(shlex.split(cmd[-1]), stdout=output, stderr=subprocess.STDOUT)
+        return "1001;cluster\n"
+    metrics.reset()
+    mocker.patch.object(SlurmDelegate, "_invoke_shell_output", autospec=True, side_effect=fake_sbatch)
+    mocker.patch("delegate_function._SlurmPoller._query_active_jobs", return_value=set())
+    mocker.patch("delegate_function._SlurmPoller._query_job_states", return_value={"1001": "FAILED"})
+    mocker.patch("delegate_function.SLURM_POLL_INTERVAL", 0.1)
+    sd = SlurmDelegate(temporary_file_root=str(tmp_path), delegate_executable_path="/opt/conda/bin/delegate-function-run")
+    future = sd.submit(TestClass(), "no_such_method")
+    with pytest.raises(DelegateFunctionException, match="(?s)state: FAILED.*End of output.*no_such_method"):
+        future.result(timeout=30)
+    assert os.listdir(tmp_path) == []
+    assert metrics.get_metric("delegate_function_failures_total").get(**sd._metric_labels()) == 1
+
+def test_metrics():
+    metrics.reset()
+    sd = DelegateChain(TestSubProcessDelegate(), TestTrivialDelegate())()
+    sd.invoke(TestClass(), "hello")
+    labels = dict(delegate="SubprocessDelegate", chain="TestSubProcessFactoryTestTrivialFactory")
+    assert sd._metric_labels() == labels
+    assert metrics.get_metric("delegate_function_calls_total").get(**labels) == 1
+    assert metrics.get_metric("delegate_function_call_seconds").get(**labels)['count'] == 1
+    assert metrics.get_metric("delegate_function_before_image_bytes").get(**labels)['sum'] > 0
+    assert metrics.get_metric("delegate_function_subprocesses_total").get(delegate="SubprocessDelegate", command="delegate-function-run") == 1
+
+    with pytest.raises(DelegateFunctionException):
+        sd.invoke(TestClass(), "no_such_method")
+    assert metrics.get_metric("delegate_function_failures_total").get(**labels) == 1
+
+    text = metrics.to_prometheus()
+    assert '# TYPE delegate_function_call_seconds histogram' in text
+    assert 'delegate_function_calls_total{chain="TestSubProcessFactoryTestTrivialFactory",delegate="SubprocessDelegate"} 2' in text
+    assert 'delegate_function_call_seconds_bucket{chain="TestSubProcessFactoryTestTrivialFactory",delegate="SubprocessDelegate",le="+Inf"} 2' in text
+
+@pytest.mark.parametrize("outer", [TestTrivialDelegate(), TestSubProcessDelegate(), TestForkServerDelegate()], ids=["trivial", "subprocess", "fork_server"])
+def test_workspace(outer, tmp_path):
+    (tmp_path / "input.txt").write_text("input")
+    (tmp_path / "delete_me.txt").write_text("delete me")
+    (tmp_path / "subdir").mkdir()
+    (tmp_path / "subdir" / "modify.txt").write_text("original")
+    (tmp_path / "untouched.txt").write_text("untouched")
+    (tmp_path / "delete_me" / "subdir").mkdir(parents=True)
+    (tmp_path / "delete_me" / "subdir" / "file.txt").write_text("delete me")
+    (tmp_path / "absolute_link").symlink_to("/dev/null")
+
+    def Workspaced(subdelegate=None, **kwargs):
+        return TemporaryDirectoryDelegate(subdelegate=subdelegate, workspace=str(tmp_path), **kwargs)
+    sd = DelegateChain(outer, TestSubProcessDelegate(), Workspaced)()
+    assert sd.invoke(WorkspaceTestClass(), "edit") == "input"
+    assert (tmp_path / "output.txt").read_text() == "INPUT"
+    assert (tmp_path / "subdir" / "modify.txt").read_text() == "original modified"
+    assert (tmp_path / "untouched.txt").read_text() == "untouched"
+    assert not (tmp_path / "delete_me.txt").exists()
+    assert not (tmp_path / "delete_me").exists()
+    assert (tmp_path / "empty").is_dir()
+    assert os.readlink(tmp_path / "absolute_link") == "/dev/null"
+
+def test_workspace_concurrent(tmp_path):
+    def chain(directory):
+        def Workspaced(subdelegate=None, **kwargs):
+            return TemporaryDirectoryDelegate(subdelegate=subdelegate, workspace=str(directory), **kwargs)
+        return DelegateChain(TestSubProcessDelegate(), TestSubProcessDelegate(), Workspaced)()
+    directories = [tmp_path / str(i) for i in range(4)]
+    for i, d in enumerate(directories):
+        (d / "subdir").mkdir(parents=True)
+        (d / "delete_me").mkdir()
+        (d / "input.txt").write_text(f"input {i}")
+        (d / "subdir" / "modify.txt").write_text("original")
+        (d / "delete_me.txt").write_text("delete me")
+    with concurrent.futures.ThreadPoolExecutor(len(directories)) as executor:
+        results = list(executor.map(lambda d: chain(d).invoke(WorkspaceTestClass(), "edit"), directories))
+    assert results == [f"input {i}" for i in range(4)]
+    for i, d in enumerate(directories):
+        assert (d / "output.txt").read_text() == f"INPUT {i}"
+
+def test_routing():
+    sd = RoutingDelegate(routes=[Route("routing-local", chain=TestTrivialDelegate()),
+                                 dict(name="routing-sandbox", chain=TestSubProcessDelegate(), tags=["sandbox"])],
+                         rules=[dict(methods=["RoutingTestClass.set_*"], requires=["sandbox"])])
+    f = RoutingTestClass()
+    sd.invoke(f, "hello")
+    assert sd.get_route_name() == "routing-local"
+    assert sd.invoke(f, "hello") != os.getpid()
+    assert sd.get_route_name() == "routing-sandbox"
+    assert sd._method_seconds is not None
+    for i in range(3):
+        assert sd.invoke(f, "hello") == os.getpid()
+        assert sd.get_route_name() == "routing-local"
+
+    assert sd.invoke(f, "untrusted") != os.getpid()
+    assert sd.get_route_name() == "routing-sandbox"
+    sd.invoke(f, "set_value", 4)
+    assert sd.get_route_name() == "routing-sandbox"
+    assert f._value == 4
+
+def test_routing_failures():
+    import delegate_function
+    sd = RoutingDelegate(routes=[dict(name="routing-broken", chain=lambda **kwargs: SubprocessDelegate(delegate_executable_path="/nonexistent", **kwargs)),
+                                 Route("routing-working", chain=TestTrivialDelegate())])
+    f = RoutingTestClass()
+    with pytest.raises(Exception):
+        sd.invoke(f, "hello")
+    assert sd.get_route_name() == "routing-broken"
+    for i in range(3):
+        assert sd.invoke(f, "hello") == os.getpid()
+        assert sd.get_route_name() == "routing-working"
+
+    delegate_function._route_stats["routing-broken"].unavailable_until = 0
+    sd.invoke(f, "hello")
+    assert sd.get_route_name() == "routing-working"
+
+def test_routing_no_route():
+    sd = RoutingDelegate(routes=[dict(name="routing-unsafe", chain=TestTrivialDelegate())])
+    with pytest.raises(DelegateFunctionException):
+        sd.invoke(RoutingTestClass(), "untrusted")
+
+def test_routing_subdelegate():
+    sd = DelegateChain(TestTrivialDelegate(), 
+                       lambda subdelegate=None, **kwargs: RoutingDelegate(subdelegate=subdelegate, routes=[dict(name="routing-tail", chain=TestTrivialDelegate())], **kwargs),
+                       TestSubProcessDelegate())()
+    assert sd.invoke(TestClass(), "hello") != os.getpid()
+
+def test_resource_hints():
+    sd = SlurmDelegate(temporary_file_root="/tmp", resources=dict(memory="2G", cpus=1))
+    sd._delegate_before_image_name = "/tmp/test.before.pickle"
+    sd._delegate_after_image_name = "/tmp/test.after.pickle"
+    sd._obj, sd._method = ResourceTestClass(), "set_value"
+    sd._call_resources = dict(time="1:00:00")
+    command = sd._compute_command_line()
+    slurm_args = ["--cpus-per-task=8", "--mem=2G", "--time=1:00:00"]
+    assert command[:5] == ["salloc"] + slurm_args + ["srun"]
+    assert command[5:9] == ["--export=ALL"] + slurm_args
+
+    sd._call_resources = None
+    sd._method = "hello"
+    assert "--cpus-per-task=1" in sd._compute_command_line()
+
+    for t, arg in [(90.0, "--time=2"), (60, "--time=1"), (1, "--time=1"), ("1-12:00:00", "--time=1-12:00:00")]:
+        sd._call_resources = dict(time=t)
+        assert arg in sd._compute_command_line()
+    sd._call_resources = dict(time="90 minutes")
+    with pytest.raises(DelegateFunctionException):
+        sd._compute_command_line()
+    sd._call_resources = dict(memory=1.5)
+    assert "--mem=2M" in sd._compute_command_line()
+
+    dd = DockerDelegate("image", temporary_file_root="/tmp", docker_cmd_line_args=["--rm"])
+    dd._delegate_before_image_name = "/tmp/test.before.pickle"
+    dd._delegate_after_image_name = "/tmp/test.after.pickle"
+    dd._obj, dd._method = ResourceTestClass(), "set_value"
+    dd._call_resources = dict(memory=512, exclusive=True)
+    assert dd._compute_command_line()[4:10] == ["--cpus", "8", "--memory", "512m", "--rm", "image"]
+    assert dd._compute_command_line()[-1] == "--relay-output"
+
+    with pytest.raises(DelegateFunctionException):
+        with resource_hints(gpus=1):
+            pass
+
+def test_resource_hints_propagate():
+    tail = TrivialDelegate()
+    sd = SubprocessDelegate(subdelegate=tail, delegate_executable_path="/opt/conda/bin/delegate-function-run")
+    with resource_hints(cpus=4):
+        with resource_hints(memory="1G"):
+            sd.invoke(TestClass(), "hello")
+    assert sd._call_resources == dict(cpus=4, memory="1G")
+    assert sd._get_resources() == dict(cpus=4, memory="1G")
+
+    head = TrivialDelegate(subdelegate=tail)
+    head._obj, head._method, head._argc, head._kwargs = TestClass(), "hello", (), {}
+    head._call_resources = dict(cpus=2) # As if it had been unpickled on the far side.
+    head._delegated_invoke()
+    assert tail._call_resources == dict(cpus=2)
+
+@pytest.mark.parametrize("factory", [TestTrivialDelegate(), 
+                                     DelegateChain(TestSubProcessDelegate(), TestTrivialDelegate()), 
+                                     TestForkServerDelegate()], ids=["trivial", "subprocess", "fork_server"])
+def test_profiling(factory):
+    sd = factory()
+    f = ProfileTestClass()
+    with profiling(tracemalloc=True) as profile:
+        assert sd.invoke(f, "work", 100) == 99
+        sd.invoke(f, "work", 10)
+    assert len(f._blocks) == 10
+    assert isinstance(profile.stats, pstats.Stats)
+    assert any(name == "work" and calls == 2 for (_, _, name), (calls, *_) in profile.stats.stats.items())
+    assert len(profile.snapshots) == 2
+    assert profile.snapshots[0].statistics("filename")[0].size >= 100 * 1024
+
+    sd.invoke(f, "work", 1)
+    assert sd._profile_data is None
+    assert len(profile.snapshots) == 2
+
+def test_admission_order():
+    scheduler.configure(limits={"order:*": 2})
+    try:
+        admitted = []
+        def call(user, priority):
+            with scheduler.admit("order:a", user=user, priority=priority):
+                admitted.append(user)
+        scheduler.acquire("order:a", user="alice")
+        scheduler.acquire("order:a", user="alice")
+        threads = []
+        for user, priority in [("alice", 0), ("bob", 0), ("carol", 5)]:
+            threads.append(threading.Thread(target=call, args=(user, priority)))
+            threads[-1].start()
+            while scheduler.get_load("order:a")[1] < len(threads):
+                time.sleep(0.01)
+        scheduler.release("order:a", "alice")
+        for t in threads:
+            t.join()
+        assert admitted == ["carol", "bob", "alice"]
+        assert scheduler.get_load("order:a") == (1, 0)
+        scheduler.release("order:a", "alice")
+    finally:
+        scheduler.reset()
+
+def test_admission_limits():
+    scheduler.configure(limits={"limits:a": 1, "limits:*": 5}, max_queue=0)
+    try:
+        assert scheduler.get_limit("limits:a") == 1
+        assert scheduler.get_limit("limits:b") == 5
+        assert scheduler.get_limit("other") is None
+        user = scheduler.acquire("limits:a")
+        with pytest.raises(DelegateFunctionException):
+            scheduler.acquire("limits:a")
+        scheduler.configure(max_queue=10, queue_timeout=0.1)
+        with pytest.raises(DelegateFunctionException):
+            scheduler.acquire("limits:a")
+        scheduler.release("limits:a", user)
+        assert scheduler.get_load("limits:a") == (0, 0)
+    finally:
+        scheduler.reset()
+
+def test_admission_delegates():
+    scheduler.configure(limits={"subprocess": 1})
+    try:
+        with scheduling(user="someone", priority=1):
+            assert TestSubProcessDelegate()().invoke(TestClass(), "hello") != os.getpid()
+        assert scheduler.get_load("subprocess") == (0, 0)
+        assert SlurmDelegate(temporary_file_root="/tmp", partition="gpu")._admission_backend() == "slurm:gpu"
+        assert SSHDelegate("test_fiddler", "ssh-host")._admission_backend() is None
+    finally:
+        scheduler.reset()
+
+def test_parallel():
+    f = ParallelTestClass()
+    sd = ParallelDelegate(branches=[dict(chain=TestTrivialDelegate()), 
+                                    dict(chain=TestSubProcessDelegate()),
+                                    Route("forked", chain=TestForkServerDelegate())])
+    pids = sd.invoke(f, "where")
+    assert len(pids) == 3
+    assert pids[0] == os.getpid()
+    assert len(set(pids)) == 3
+    assert f._value == 0
+    assert [b.name for b in sd.get_branches()] == ["branch0", "branch1", "forked"]
+
+    sd = ParallelDelegate(branches=[dict(chain=TestTrivialDelegate()), dict(chain=TestSubProcessDelegate())], collect="first")
+    pid = sd.invoke(f, "fail_in", os.getpid())
+    assert pid != os.getpid()
+    assert f._value == pid
+
+    sd = ParallelDelegate(branches=[dict(chain=TestTrivialDelegate())], collect="first")
+    with pytest.raises(DelegateFunctionException):
+        sd.invoke(f, "fail_in", os.getpid())
+
+    sd = ParallelDelegate(branches=[dict(chain=TestTrivialDelegate()), dict(chain=TestSubProcessDelegate())])
+    with pytest.raises(DelegateFunctionException):
+        sd.invoke(f, "fail_in", os.getpid())
+
+def test_parallel_local_attributes():
+    f = AttributeShippingClass()
+    f._lock = lock = (i for i in range(3)) # Generators can't be pickled, even by dill.
+    sd = ParallelDelegate(branches=[dict(chain=TestTrivialDelegate()), dict(chain=TestSubProcessDelegate())], collect="first")
+    sd.invoke(f, "compute")
+    assert f._output == 2
+    assert f._lock is lock
+
+def test_parallel_custom_pickling():
+    f = CustomPickleClass()
+    sd = ParallelDelegate(branches=[dict(chain=TestTrivialDelegate()), dict(chain=TestSubProcessDelegate())], collect="first")
+    assert sd.invoke(f, "size") == 4
+    assert f._items == [1, 2, 3, 4]
+    assert list(f._generator) == [1, 2, 3, 4]
+
+def test_parallel_profiling():
+    sd = ParallelDelegate(branches=[dict(chain=TestTrivialDelegate()), dict(chain=TestSubProcessDelegate())], 
+                          collect="reduce", reduce="operator.add")
+    with profiling(tracemalloc=True) as profile:
+        assert sd.invoke(ProfileTestClass(), "work", 10) == 18
+    assert any(name == "work" and calls == 2 for (_, _, name), (calls, *_) in profile.stats.stats.items())
+    assert len(profile.snapshots) == 2
+
+@pytest.mark.parametrize("collect", ["first", "list"])
+def test_parallel_workspace(tmp_path, collect):
+    (tmp_path / "workspace" / "subdir").mkdir(parents=True)
+    (tmp_path / "workspace" / "delete_me").mkdir()
+    (tmp_path / "workspace" / "input.txt").write_text("input")
+    (tmp_path / "workspace" / "subdir" / "modify.txt").write_text("original")
+    (tmp_path / "workspace" / "delete_me.txt").write_text("delete me")
+    def Workspaced(subdelegate=None, **kwargs):
+        return TemporaryDirectoryDelegate(subdelegate=subdelegate, workspace=str(tmp_path / "workspace"), **kwargs)
+    def Parallel(subdelegate=None, **kwargs):
+        return ParallelDelegate(subdelegate=subdelegate, collect=collect,
+                                branches=[dict(sequence=[dict(type="SubprocessDelegate")])] * 2, **kwargs)
+    archives = lambda: set(glob.glob(os.path.join(tempfile.gettempdir(), "*.tar.gz")))
+    before = archives()
+    sd = DelegateChain(Parallel, Workspaced)()
+    sd.invoke(WorkspaceTestClass(), "edit")
+    assert (tmp_path / "workspace" / "output.txt").exists() == (collect == "first")
+    # With "first", the other branch may still be running.
+    deadline = time.time() + 10
+    while not archives() <= before and time.time() < deadline:
+        time.sleep(0.1)
+    assert archives() <= before
+
+def test_parallel_subdelegate():
+    sd = DelegateChain(TestSubProcessDelegate(),
+                       lambda subdelegate=None, **kwargs: ParallelDelegate(subdelegate=subdelegate, collect="reduce", reduce="operator.add",
+                                                                           branches=[dict(sequence=[dict(type="TrivialDelegate")])] * 2, **kwargs),
+                       TestSubProcessDelegate())()
+    assert sd.invoke(ParallelTestClass(), "where") > 0
+
+def test_runner_zipapp(tmp_path):
+    import delegate_function
+    archive, digest = delegate_function._build_runner_zipapp()
+    assert delegate_function._build_runner_zipapp()[1] == digest
+    build_runner_zipapp(tmp_path / "runner.pyz")
+    # -I -S keeps the installed packages out of sys.path, so this only works if the zipapp is self-contained.
+    r = subprocess.run([sys.executable, "-I", "-S", str(tmp_path / "runner.pyz"), "--help"], capture_output=True, text=True)
+    assert r.returncode == 0, r.stderr
+    assert "--delegate-before" in r.stdout
+
+    sd = SubprocessDelegate(temporary_file_root=str(tmp_path), deploy_runner=True)
+    f = TestClass()
+    sd.invoke(f, "set_value", 4)
+    assert f._value == 4
+    runner = tmp_path / delegate_function._runner_file_name()
+    mtime = runner.stat().st_mtime_ns
+    sd.invoke(f, "set_value", 5)
+    assert runner.stat().st_mtime_ns == mtime
+    assert f._value == 5
+
+def test_runner_zipapp_nested(tmp_path):
+    import delegate_function
+    (tmp_path / "outer").mkdir()
+    (tmp_path / "inner").mkdir()
+    sd = DelegateChain(lambda subdelegate=None, **kwargs: SubprocessDelegate(subdelegate=subdelegate, deploy_runner=True,
+                                                                              temporary_file_root=str(tmp_path / "outer"), **kwargs),
+                       lambda subdelegate=None, **kwargs: SubprocessDelegate(subdelegate=subdelegate, deploy_runner=True,
+                                                                              temporary_file_root=str(tmp_path / "inner"), **kwargs))()
+    f = TestClass()
+    sd.invoke(f, "set_value", 4)
+    assert f._value == 4
+    runner = delegate_function._runner_file_name()
+    assert (tmp_path / "outer" / runner).read_bytes() == (tmp_path / "inner" / runner).read_bytes()
+
+def test_runner_zipapp_fork_server(tmp_path):
+    build_runner_zipapp(tmp_path / "runner.pyz")
+    # -I -S keeps the installed packages out of sys.path, here and in the fork server, like on a host where we deployed the runner.
+    python = tmp_path / "python"
+    python.write_text(f"#!/bin/sh\nexec {sys.executable} -I -S \"$@\"\n")
+    python.chmod(0o755)
+    code = (f"import sys; sys.executable = {str(python)!r}; sys.path.insert(0, {str(tmp_path / 'runner.pyz')!r}); "
+            "import delegate_function, os; "
+            "assert delegate_function.ForkServerDelegate().invoke(delegate_function.TestClass(), 'hello') != os.getpid()")
+    r = subprocess.run([str(python), "-c", code], capture_output=True, text=True, timeout=60)
+    assert r.returncode == 0, r.stderr
+
+def test_sudo_deploy_runner_directory(tmp_path):
+    # The target user can't read our ~/.cache, so the runner goes in the temporary directory, which setfacl covers.
+    sd = SudoDelegate(user="cfiddle", deploy_runner=True)
+    sd._temporary_file_root = str(tmp_path)
+    assert os.path.dirname(sd._find_delegate_function_executable()) == str(tmp_path)
+
+def test_ssh_deploy_runner(mocker, tmp_path):
+    sd = SSHDelegate("test_fiddler", "ssh-host", deploy_runner=True, remote_runner_directory=str(tmp_path / "runners"))
+    commands = []
+    fake_ssh(mocker, commands=commands)
+    mocker.patch("delegate_function._deployed_runners", set())
+
+    f = TestClass()
+    sd.invoke(f, "set_value", 4)
+    assert f._value == 4
+    assert any("mv" in c for c in commands)
+    assert len(os.listdir(tmp_path / "runners")) == 1
+
+    commands.clear()
+    sd.invoke(f, "set_value", 5)
+    assert f._value == 5
+    assert not any("test" in c or "mv" in c for c in commands)
+
+def test_lazy_attributes():
+    metrics.reset()
+    sd = TestSubProcessDelegate(lazy_threshold=4096)()
+    f = LazyTestClass(1 << 20)
+    assert sd.invoke(f, "loaded") == ["_small"]
+    assert metrics.get_metric("delegate_function_before_image_bytes").get(**sd._metric_labels())['sum'] < 4096
+    assert metrics.get_metric("delegate_function_after_image_bytes").get(**sd._metric_labels())['sum'] < 4096
+    assert f._big == b"b" * (1 << 20)
+
+    assert sd.invoke(f, "use_big") == ["_big", "_small"]
+    assert f._small == 1 << 20
+    assert f._other_big == [b"o" * (1 << 20)]
+
+    sd = DelegateChain(TestSubProcessDelegate(lazy_threshold=4096), TestTrivialDelegate())()
+    assert sd.invoke(f, "loaded") == ["_big", "_other_big", "_small"]
+
+def test_lazy_custom_pickling():
+    f = CustomPickleClass()
+    f._items = list(range(1 << 16))
+    assert TestSubProcessDelegate(lazy_threshold=4096)().invoke(f, "size") == (1 << 16) + 1
+    assert len(list(f._generator)) == (1 << 16) + 1
+
+def test_output_capture():
+    received = []
+    sd = TestSubProcessDelegate(output_handler=lambda label, stream, line: received.append((label, stream, line)), 
+                                output_tail_bytes=1000)()
+    assert sd.invoke(ChattyClass(), "chatter", 10) == 10
+    assert ("SubprocessDelegate", "stdout", "out 9\n") in received
+    assert ("SubprocessDelegate", "stderr", "err 9\n") in received
+    assert max(len(line) for label, stream, line in received) == OUTPUT_MAX_LINE
+    assert received[-1][2] == "x"
+
+    received.clear()
+    with pytest.raises(DelegateFunctionException) as e:
+        sd.invoke(ChattyClass(), "chatter", 1000, fail=True)
+    assert "Chatty failure" in e.value.stderr_tail
+    assert "Chatty failure" in str(e.value)
+    assert "err 0\n" not in e.value.stderr_tail
+    assert len(e.value.stderr_tail) < 2000
+    assert e.value.stdout_tail == "x"
+    assert len(received) > 2000
+
+def test_output_relay():
+    received = []
+    sd = DelegateChain(TestSubProcessDelegate(output_handler=lambda label, stream, line: received.append((label, stream, line))),
+                       TestSubProcessDelegate())()
+    sd.invoke(ChattyClass(), "chatter", 2)
+    assert ("SubprocessDelegate", "stdout", "out 1\n") in received
+    assert "".join(line for label, stream, line in received if stream == "stdout") == "out 0\nout 1\n" + "x" * (OUTPUT_MAX_LINE * 2 + 1)
+
+    import delegate_function
+    long_line = "\u00e9" * OUTPUT_MAX_LINE + "\n"
+    data = (delegate_function._relay_record("Inner", "relayed\n") + b"plain\n" + long_line.encode() + 
+            delegate_function._relay_record("Inner", "unterminated") + b"last")
+    tail = delegate_function._OutputTail(1000)
+    received = []
+    delegate_function._pump_output(io.BufferedReader(io.BytesIO(data)), "stdout", tail, lambda *args: received.append(args))
+    assert received[:2] == [("stdout", "relayed\n", "Inner"), ("stdout", "plain\n", None)]
+    assert "".join(line for stream, line, label in received[2:-2]) == long_line
+    assert received[-2:] == [("stdout", "unterminated", "Inner"), ("stdout", "last", None)]
+
+def test_output_drain_timeout(mocker):
+    mocker.patch("delegate_function.OUTPUT_DRAIN_SECONDS", 0.5)
+    received = []
+    sd = SubprocessDelegate(output_handler=lambda label, stream, line: received.append(line))
+    start = time.time()
+    sd._invoke_shell(["sh", "-c", "sleep 30 & echo started"])
+    assert time.time() - start < 10
+    assert received == ["started\n"]
+
+def test_output_log(caplog):
+    sd = TestSubProcessDelegate(output_handler="log")()
+    with caplog.at_level(log.INFO):
+        sd.invoke(ChattyClass(), "chatter", 1)
+    assert "[SubprocessDelegate] out 0" in caplog.text
@@ -25,6 +25,15 @@ sequence:
 #################################
 """
 version: 0.1
+sequence: 
+  - type: ForkServerDelegate
+    preload_modules: [yaml]
+  - type: SubprocessDelegate
+    delegate_executable_path: /opt/conda/bin/delegate-function-run
+""",
+#################################
+"""
+version: 0.1
 sequence: 
   - type: DockerDelegate
     docker_image: cfiddle-slurm:21.08.6.1
@@ -97,6 +106,24 @@ sequence:
 ,
 """
 version: 0.1
+sequence:
+  - type: RoutingDelegate
+    routes:
+      - name: yaml-local
+        sequence:
+          - type: TrivialDelegate
+      - name: yaml-sandbox
+        tags: [sandbox]
+        sequence:
+          - type: SubprocessDelegate
+            delegate_executable_path: /opt/conda/bin/delegate-function-run
+    rules:
+      - methods: ["hello"]
+        requires: [sandbox]
+"""
+,
+"""
+version: 0.1
 sequence: 
   - type: SudoDelegate
     user: cfiddle
@@ -187,4 +214,53 @@ sequence:
         sd = DelegateGenerator(yaml=t)
         f = TestClass()
         sd.invoke(f, "hello")
-   
\ No newline at end of file
+   
+def test_resources():
+    sd = DelegateGenerator(yaml="""
+version: 0.1
+sequence:
+  - type: SlurmDelegate
+    temporary_file_root: /scratch/
+    resources:
+      cpus: 4
+      memory: 8G
+      exclusive: true
+""")
+    assert sd._delegates[0]()._resources == dict(cpus=4, memory="8G", exclusive=True)
+
+def test_admission():
+    try:
+        sd = DelegateGenerator(yaml="""
+version: 0.1
+admission:
+  limits:
+    "ssh:*": 4
+  max_queue: 100
+sequence:
+  - type: TrivialDelegate
+""")
+        assert scheduler.get_limit("ssh:some-host") == 4
+        sd.invoke(TestClass(), "hello")
+    finally:
+        scheduler.reset()
+
+def test_parallel():
+    sd = DelegateGenerator(yaml="""
+version: 0.1
+sequence:
+  - type: SubprocessDelegate
+    delegate_executable_path: /opt/conda/bin/delegate-function-run
+  - parallel:
+      collect: list
+      branches:
+        - sequence:
+            - type: TrivialDelegate
+        - name: forked
+          sequence:
+            - type: SubprocessDelegate
+              delegate_executable_path: /opt/conda/bin/delegate-function-run
+""")
+    pids = sd.invoke(TestClass(), "hello")
+    assert len(pids) == 2
+    assert os.getpid() not in pids
+    assert pids[0] != pids[1]